@@ -15,3 +15,5 @@ method see: https://arxiv.org/abs/2007.13086
 Once the anonymized training data is returned, it can be used to retrain the model.
 """
 from apt.anonymization.anonymizer import Anonymize
+from apt.anonymization.compact import CompactAnonymizedData
+from apt.anonymization.histogram_tree import HistogramTree
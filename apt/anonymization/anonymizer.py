@@ -1,15 +1,34 @@
+import os
+import time
+import tracemalloc
 import numpy as np
 import pandas as pd
-from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
 
 from sklearn.compose import ColumnTransformer
 from sklearn.impute import SimpleImputer
 from sklearn.pipeline import Pipeline
 from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
-from sklearn.preprocessing import OneHotEncoder
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder
+from sklearn.utils.validation import check_is_fitted
+from apt.anonymization.compact import CompactAnonymizedData
+from apt.anonymization.histogram_tree import HistogramTree
 from apt.utils.datasets import ArrayDataset, DATA_PANDAS_NUMPY_TYPE
 
-from typing import Union, Optional
+from typing import Callable, Union, Optional
+
+
+@dataclass
+class PhaseStats:
+    """
+    Statistics of one phase of the anonymization process, accumulated over all the times the phase ran during the
+    last call to an `Anonymize` method.
+    """
+    wall_time: float = 0.0
+    peak_memory: int = None
+    rows: int = 0
+    leaves: int = None
 
 
 class Anonymize:
@@ -33,33 +52,308 @@ class Anonymize:
     :param train_only_QI: The required method to train data set for anonymization. Default is
                           to train the tree on all features.
     :type train_only_QI: boolean, optional
+    :param representative: The method for choosing the representative value of numeric quasi-identifiers in each
+                           cell. 'median' uses the value in the cell closest to the cell median, 'mean' uses the
+                           cell mean (centroid), in which case integer data is returned as float. Categorical
+                           quasi-identifiers always use the most common value. Default is 'median'.
+    :type representative: str, optional
+    :param tree_method: The method used to build the anonymizer tree. 'exact' fits a scikit-learn decision tree,
+                        'hist' fits a `HistogramTree`, which bins each feature into at most 256 quantile bins and is
+                        much faster on large datasets. Default is 'exact'.
+    :type tree_method: str, optional
+    :param categorical_encoding: How categorical features are encoded before training the anonymizer tree.
+                                 'onehot' uses a sparse one-hot encoding, so memory grows with the number of non-zero
+                                 entries and not with the number of categories. 'ordinal' encodes each categorical
+                                 feature as a single column of integer codes. 'onehot' cannot be used with tree_method
+                                 'hist', which bins every encoded column and would grow with the number of categories.
+                                 Default is 'ordinal' with tree_method 'hist' and 'onehot' otherwise.
+    :type categorical_encoding: str, optional
+    :param deduplicate: Whether to collapse rows with identical training features and label before training the
+                        anonymizer tree. The tree is then trained on the distinct rows, weighted by their number of
+                        occurrences, with the k constraint still enforced on the number of records. This is much
+                        faster for data with many duplicate rows. Default is False.
+    :type deduplicate: boolean, optional
+    :param trace_memory: Whether to record the peak memory allocated in each phase of the anonymization (using
+                         tracemalloc, which slows the process down). Default is False.
+    :type trace_memory: boolean, optional
+    :param stats_callback: Function that is called with the phase name and its `PhaseStats` each time a phase of the
+                           anonymization ends, e.g., for sending them to a metrics system.
+    :type stats_callback: Callable, optional
     """
 
     def __init__(self, k: int, quasi_identifiers: Union[np.ndarray, list], categorical_features: Optional[list] = None,
-                 is_regression: Optional[bool] = False, train_only_QI: Optional[bool] = False):
+                 is_regression: Optional[bool] = False, train_only_QI: Optional[bool] = False,
+                 representative: Optional[str] = 'median', tree_method: Optional[str] = 'exact',
+                 categorical_encoding: Optional[str] = None, deduplicate: Optional[bool] = False,
+                 trace_memory: Optional[bool] = False,
+                 stats_callback: Optional[Callable[[str, PhaseStats], None]] = None):
         if k < 2:
             raise ValueError("k should be a positive integer with a value of 2 or higher")
         if quasi_identifiers is None or len(quasi_identifiers) < 1:
             raise ValueError("The list of quasi-identifiers cannot be empty")
+        if representative not in ('median', 'mean'):
+            raise ValueError("representative should be either 'median' or 'mean'")
+        if tree_method not in ('exact', 'hist'):
+            raise ValueError("tree_method should be either 'exact' or 'hist'")
+        if categorical_encoding not in (None, 'onehot', 'ordinal'):
+            raise ValueError("categorical_encoding should be either 'onehot' or 'ordinal'")
+        if tree_method == 'hist' and categorical_encoding == 'onehot':
+            raise ValueError("categorical_encoding 'onehot' cannot be used with tree_method 'hist', use 'ordinal'")
 
         self.k = k
         self.quasi_identifiers = quasi_identifiers
         self.categorical_features = categorical_features
         self.is_regression = is_regression
         self.train_only_QI = train_only_QI
+        self.representative = representative
+        self.tree_method = tree_method
+        self.categorical_encoding = categorical_encoding
+        if categorical_encoding is None:
+            categorical_encoding = 'ordinal' if tree_method == 'hist' else 'onehot'
+        self._categorical_encoding = categorical_encoding
+        self.deduplicate = deduplicate
+        self.trace_memory = trace_memory
+        self.stats_callback = stats_callback
         self.features_names = None
         self.features = None
+        self._preprocessor = None
+        # column indexes of the quasi-identifiers and categorical features, resolved from the data on each call
+        self._quasi_identifiers = None
+        self._categorical_features = None
+        self._stats = {}
 
-    def anonymize(self, dataset: ArrayDataset) -> DATA_PANDAS_NUMPY_TYPE:
+    @property
+    def stats(self):
+        """
+        Return the statistics of the last call to `anonymize`, `fit`, `transform`, `sweep` or `anonymize_file`:
+        wall time, peak traced memory (if ``trace_memory`` is set), number of rows processed and number of leaves
+        for each phase ('deduplicate', 'encoding', 'tree_fitting', 'apply' (routing records to the tree leaves),
+        'calculate_cells', 'find_representatives', 'merge_leaves' and 'anonymize_data'). 'calculate_cells' works on
+        the tree only and processes no rows.
+
+        :return: Dictionary mapping the name of each phase that ran to its `PhaseStats`.
+        """
+        return self._stats
+
+    def anonymize(self, dataset: ArrayDataset,
+                  compact: Optional[bool] = False) -> Union[DATA_PANDAS_NUMPY_TYPE, CompactAnonymizedData]:
         """
         Method for performing model-guided anonymization.
 
         :param dataset: Data wrapper containing the training data for the model and the predictions of the
                         original model on the training data.
         :type dataset: `ArrayDataset`
+        :param compact: Whether to return the anonymized data as a `CompactAnonymizedData` (cell of each record plus
+                        a table of cell representatives) instead of a full copy of the data. Default is False.
+        :type compact: boolean, optional
         :return: The anonymized training dataset as either numpy array or pandas DataFrame (depending on the type of
-                 the original data used to create the ArrayDataset).
+                 the original data used to create the ArrayDataset), or as `CompactAnonymizedData`.
+        """
+        self._stats = {}
+        self._set_features(dataset)
+        if compact:
+            node_ids = self._fit_cells(dataset.get_samples(), dataset.get_labels())
+            return self._to_compact(node_ids, dataset)
+        transformed = self._anonymize(dataset.get_samples().copy(), dataset.get_labels())
+        return self._to_output(transformed, dataset)
+
+    def fit(self, dataset: ArrayDataset):
+        """
+        Learns the anonymizer tree and the representative values of its cells, without anonymizing the data. Once
+        fitted, new records can be anonymized using `transform`.
+
+        :param dataset: Data wrapper containing the training data for the model and the predictions of the
+                        original model on the training data.
+        :type dataset: `ArrayDataset`
+        :return: self
+        """
+        self._stats = {}
+        self._set_features(dataset)
+        self._fit_cells(dataset.get_samples(), dataset.get_labels())
+        return self
+
+    def transform(self, dataset: ArrayDataset,
+                  compact: Optional[bool] = False) -> Union[DATA_PANDAS_NUMPY_TYPE, CompactAnonymizedData]:
+        """
+        Anonymizes records using the cells learned by `fit`. Each record is routed to the cell it falls into and its
+        quasi-identifiers are replaced with the representative values of that cell. The k-anonymity guarantee refers
+        to the data `fit` was called on; the transformed records do not change the cells.
+
+        :param dataset: Data wrapper containing the records to anonymize (labels are not required), with the same
+                        features as the data used in `fit`.
+        :type dataset: `ArrayDataset`
+        :param compact: Whether to return the anonymized records as a `CompactAnonymizedData` instead of a full copy
+                        of the data. Default is False.
+        :type compact: boolean, optional
+        :return: The anonymized records as either numpy array or pandas DataFrame (depending on the type of the
+                 original data used to create the ArrayDataset), or as `CompactAnonymizedData`.
+        """
+        msg = 'This %(name)s instance is not fitted yet. Call `fit` with appropriate arguments before using this ' \
+              'method.'
+        check_is_fitted(self, ['_representatives'], msg=msg)
+        self._stats = {}
+        x = dataset.get_samples()
+        if x.shape[1] != len(self.features):
+            raise ValueError('Shape of input is different from what was seen in `fit`')
+        node_ids = self._find_sample_nodes(self._prepare_data(x))
+        if compact:
+            return self._to_compact(node_ids, dataset)
+        return self._to_output(self._anonymize_data(x.copy(), node_ids), dataset)
+
+    def sweep(self, dataset: ArrayDataset, k_values: list, compact: Optional[bool] = False) -> dict:
+        """
+        Performs model-guided anonymization for several values of k, fitting the anonymizer tree only once.
+
+        The tree is fitted with the k of this instance, which should be the smallest requested value. The cells for
+        each larger k are derived from its leaves by merging undersized leaves bottom-up with their siblings (or with
+        the smallest cell of their subtree), so that each resulting cell contains at least k records. Only the
+        representative values are recomputed for each k.
+
+        :param dataset: Data wrapper containing the training data for the model and the predictions of the
+                        original model on the training data.
+        :type dataset: `ArrayDataset`
+        :param k_values: The values of k to anonymize the data for. Should not be smaller than the k of this
+                         instance.
+        :type k_values: list
+        :param compact: Whether to return each anonymized dataset as a `CompactAnonymizedData` instead of a full copy
+                        of the data. Default is False.
+        :type compact: boolean, optional
+        :return: Dictionary mapping each value of k to the data anonymized for it, as either numpy array or pandas
+                 DataFrame (depending on the type of the original data used to create the ArrayDataset), or as
+                 `CompactAnonymizedData`.
+        """
+        if min(k_values) < self.k:
+            raise ValueError('k_values should not be smaller than k')
+        self._stats = {}
+        self._set_features(dataset)
+        x = dataset.get_samples()
+        node_ids = self._fit_cells(x, dataset.get_labels())
+        leaf_counts = np.bincount(node_ids, minlength=self._anonymizer.tree_.node_count)
+        anonymized = {}
+        for k in sorted(set(k_values)):
+            with self._phase('merge_leaves', x.shape[0]) as stats:
+                cell_ids = self._merge_leaves(leaf_counts, k)[node_ids]
+                stats.leaves = int(cell_ids.max()) + 1
+            representatives = self._find_representatives(x, cell_ids, cell_ids.max() + 1)
+            if compact:
+                anonymized[k] = CompactAnonymizedData(x, cell_ids.astype(np.int32), representatives,
+                                                      self._quasi_identifiers, self.features_names, dataset.is_pandas)
+            else:
+                transformed = self._write_representatives(x.copy(), cell_ids, representatives)
+                anonymized[k] = self._to_output(transformed, dataset)
+        return anonymized
+
+    def anonymize_file(self, input_path: str, output_path: str, label_column: Union[str, int],
+                       chunk_size: Optional[int] = 100000, sample_size: Optional[int] = 1000000,
+                       random_state: Optional[int] = None) -> np.ndarray:
+        """
+        Method for performing model-guided anonymization of data stored in a file that may be larger than memory.
+
+        The anonymizer is first fitted on a uniform random sample of the rows (or on all rows, if ``sample_size`` is
+        None). The input is then read in chunks, each chunk is routed to the fitted cells and written anonymized to
+        the output file, so that memory usage depends on the chunk and sample sizes and not on the input size. The
+        number of rows in each cell is counted over the whole input and checked against k.
+
+        Supported inputs are CSV files with a header row (anonymized into a CSV file) and ``.npy`` files, which are
+        memory-mapped (anonymized into a ``.npy`` file with the same shape and dtype).
+
+        :param input_path: Path of the input file.
+        :type input_path: string
+        :param output_path: Path of the output file.
+        :type output_path: string
+        :param label_column: Name (CSV) or index (npy) of the column containing the predictions of the original model.
+                             It is used for training the anonymizer and is written to the output unchanged. Quasi
+                             identifiers and categorical features are given as names (CSV) or indexes (npy) of the
+                             input file columns.
+        :type label_column: string or int
+        :param chunk_size: Number of rows read and anonymized at a time. Default is 100000.
+        :type chunk_size: int, optional
+        :param sample_size: Maximal number of rows used to fit the anonymizer. If None, all rows are used. Default is
+                            1000000.
+        :type sample_size: int, optional
+        :param random_state: Seed used for drawing the sample.
+        :type random_state: int, optional
+        :return: The number of input rows in each cell.
         """
+        self._stats = {}
+        rng = np.random.default_rng(random_state)
+        if input_path.endswith('.npy'):
+            counts = self._anonymize_npy(input_path, output_path, label_column, chunk_size, sample_size, rng)
+        else:
+            counts = self._anonymize_csv(input_path, output_path, label_column, chunk_size, sample_size, rng)
+        if counts.min() < self.k:
+            os.remove(output_path)
+            raise ValueError('Anonymized data does not satisfy %d-anonymity, input changed while anonymizing?'
+                             % self.k)
+        return counts
+
+    def _anonymize_csv(self, input_path, output_path, label_column, chunk_size, sample_size, rng):
+        sample = self._sample_csv(input_path, chunk_size, sample_size, rng)
+        if label_column not in sample.columns:
+            raise ValueError('label_column should be one of the columns of the input file')
+        self.fit(ArrayDataset(sample.drop(columns=label_column), sample[label_column]))
+        del sample
+
+        counts = np.zeros(len(self._nodes), dtype=np.int64)
+        header = True
+        for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+            x = chunk.drop(columns=label_column).to_numpy()
+            node_ids = self._find_sample_nodes(self._prepare_data(x))
+            counts += np.bincount(self._cell_index[node_ids], minlength=len(self._nodes))
+            x = self._anonymize_data(x, node_ids)
+            for feature in self._quasi_identifiers:
+                chunk[self.features_names[feature]] = x[:, feature]
+            chunk.to_csv(output_path, mode='w' if header else 'a', header=header, index=False)
+            header = False
+        return counts
+
+    @staticmethod
+    def _sample_csv(input_path, chunk_size, sample_size, rng):
+        if sample_size is None:
+            return pd.read_csv(input_path)
+        # keep the rows with the smallest random keys seen so far, which is a uniform sample of the rows read
+        sample = None
+        keys = None
+        for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+            chunk_keys = rng.random(len(chunk))
+            if sample is not None:
+                chunk = pd.concat([sample, chunk])
+                chunk_keys = np.concatenate([keys, chunk_keys])
+            if len(chunk) > sample_size:
+                keep = np.sort(np.argpartition(chunk_keys, sample_size)[:sample_size])
+                chunk = chunk.iloc[keep]
+                chunk_keys = chunk_keys[keep]
+            sample = chunk
+            keys = chunk_keys
+        return sample
+
+    def _anonymize_npy(self, input_path, output_path, label_column, chunk_size, sample_size, rng):
+        data = np.load(input_path, mmap_mode='r')
+        if label_column not in range(data.shape[1]):
+            raise ValueError('label_column should be an index of a column of the input file')
+        feature_columns = [i for i in range(data.shape[1]) if i != label_column]
+        if sample_size is None or sample_size >= data.shape[0]:
+            sample = np.asarray(data)
+        else:
+            sample = data[np.sort(rng.choice(data.shape[0], size=sample_size, replace=False))]
+        self.fit(ArrayDataset(sample[:, feature_columns], sample[:, label_column], feature_columns))
+        del sample
+
+        counts = np.zeros(len(self._nodes), dtype=np.int64)
+        dtype = np.result_type(data.dtype, self._representatives.dtype)
+        output = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype, shape=data.shape)
+        for start in range(0, data.shape[0], chunk_size):
+            chunk = data[start:start + chunk_size]
+            x = chunk[:, feature_columns]
+            node_ids = self._find_sample_nodes(self._prepare_data(x))
+            counts += np.bincount(self._cell_index[node_ids], minlength=len(self._nodes))
+            output[start:start + chunk_size, feature_columns] = self._anonymize_data(x, node_ids)
+            output[start:start + chunk_size, label_column] = chunk[:, label_column]
+        output.flush()
+        del output
+        return counts
+
+    def _set_features(self, dataset):
         if dataset.get_samples().shape[1] != 0:
             self.features = [i for i in range(dataset.get_samples().shape[1])]
         else:
@@ -76,117 +370,275 @@ class Anonymize:
         if self.categorical_features and not set(self.categorical_features).issubset(set(self.features_names)):
             raise ValueError('Categorical features should bs a subset of the supplied features or indexes in range of '
                              'the data columns')
-        self.quasi_identifiers = [i for i, v in enumerate(self.features_names) if v in self.quasi_identifiers]
+        self._quasi_identifiers = [i for i, v in enumerate(self.features_names) if v in self.quasi_identifiers]
+        self._categorical_features = None
         if self.categorical_features:
-            self.categorical_features = [i for i, v in enumerate(self.features_names) if v in self.categorical_features]
+            self._categorical_features = [i for i, v in enumerate(self.features_names)
+                                          if v in self.categorical_features]
 
-        transformed = self._anonymize(dataset.get_samples().copy(), dataset.get_labels())
+    def _to_output(self, transformed, dataset):
         if dataset.is_pandas:
             return pd.DataFrame(transformed, columns=self.features_names)
         else:
             return transformed
 
+    def _to_compact(self, node_ids, dataset):
+        return CompactAnonymizedData(dataset.get_samples(), self._cell_index[node_ids].astype(np.int32),
+                                     self._representatives, self._quasi_identifiers, self.features_names,
+                                     dataset.is_pandas)
+
     def _anonymize(self, x, y):
+        node_ids = self._fit_cells(x, y)
+        return self._anonymize_data(x, node_ids)
+
+    def _fit_cells(self, x, y):
+        # fits the anonymizer tree and the cell table, returns the leaf node each row of x falls into
         if x.shape[0] != y.shape[0]:
             raise ValueError("x and y should have same number of rows")
-        if x.dtype.kind not in 'iufc':
-            if not self.categorical_features:
-                raise ValueError('when supplying an array with non-numeric data, categorical_features must be defined')
-            x_prepared = self._modify_categorical_features(x)
+        if self.deduplicate:
+            # fit on the distinct rows only, weighted by their number of occurrences
+            with self._phase('deduplicate', x.shape[0]):
+                unique_rows, row_groups, counts = self._deduplicate(x, y)
+                x_fit = x[unique_rows]
+                y_fit = y[unique_rows]
         else:
-            x_prepared = x
-        x_anonymizer_train = x_prepared
-        if self.train_only_QI:
-            # build DT just on QI features
-            x_anonymizer_train = x_prepared[:, self.quasi_identifiers]
-        if self.is_regression:
-            self._anonymizer = DecisionTreeRegressor(random_state=10, min_samples_split=2, min_samples_leaf=self.k)
-        else:
-            self._anonymizer = DecisionTreeClassifier(random_state=10, min_samples_split=2, min_samples_leaf=self.k)
-
-        self._anonymizer.fit(x_anonymizer_train, y)
-        cells_by_id = self._calculate_cells(x, x_anonymizer_train)
-        return self._anonymize_data(x, x_anonymizer_train, cells_by_id)
-
-    def _calculate_cells(self, x, x_anonymizer_train):
-        # x is original data, x_anonymizer_train is only QIs + 1-hot encoded
-        cells_by_id = {}
-        leaves = []
-        for node, feature in enumerate(self._anonymizer.tree_.feature):
-            if feature == -2:  # leaf node
-                leaves.append(node)
-                hist = [int(i) for i in self._anonymizer.tree_.value[node][0]]
-                # TODO we may change the method for choosing representative for cell
-                # label_hist = self.anonymizer.tree_.value[node][0]
-                # label = int(self.anonymizer.classes_[np.argmax(label_hist)])
-                cell = {'label': 1, 'hist': hist, 'id': int(node)}
-                cells_by_id[cell['id']] = cell
-        self._nodes = leaves
-        self._find_representatives(x, x_anonymizer_train, cells_by_id.values())
-        return cells_by_id
-
-    def _find_representatives(self, x, x_anonymizer_train, cells):
-        # x is original data, x_anonymizer_train is only QIs + 1-hot encoded
+            x_fit = x
+            y_fit = y
+            counts = None
+        self._preprocessor = None
+        with self._phase('encoding', x_fit.shape[0]):
+            if x.dtype.kind not in 'iufc':
+                if not self._categorical_features:
+                    raise ValueError('when supplying an array with non-numeric data, categorical_features must be '
+                                     'defined')
+                x_prepared = self._modify_categorical_features(x_fit)
+            else:
+                x_prepared = x_fit
+            x_anonymizer_train = self._train_features(x_prepared)
+        self._anonymizer = self._create_anonymizer(x_fit.shape[0], x.shape[0] if self.deduplicate else None)
+
+        with self._phase('tree_fitting', x_fit.shape[0]) as stats:
+            self._anonymizer.fit(x_anonymizer_train, y_fit, sample_weight=counts)
+            stats.leaves = int(np.count_nonzero(self._anonymizer.tree_.feature == -2))
         node_ids = self._find_sample_nodes(x_anonymizer_train)
-        for cell in cells:
-            cell['representative'] = {}
-            # get all rows in cell
-            indexes = [index for index, node_id in enumerate(node_ids) if node_id == cell['id']]
-            # TODO: should we filter only those with majority label? (using hist)
-            rows = x[indexes]
-            for feature in self.quasi_identifiers:
-                values = rows[:, feature]
-                if self.categorical_features and feature in self.categorical_features:
-                    # find most common value
-                    cell['representative'][feature] = Counter(values).most_common(1)[0][0]
-                else:
-                    # find the mean value (per feature)
-                    median = np.median(values)
-                    min_value = max(values)
-                    min_dist = float("inf")
-                    for value in values:
-                        # euclidean distance between two floating point values
-                        dist = abs(value - median)
-                        if dist < min_dist:
-                            min_dist = dist
-                            min_value = value
-                    cell['representative'][feature] = min_value
+        if self.deduplicate:
+            node_ids = node_ids[row_groups]
+        self._calculate_cells()
+        self._representatives = self._find_representatives(x, self._cell_index[node_ids], len(self._nodes))
+        return node_ids
+
+    def _create_anonymizer(self, n_rows, n_weighted_rows=None):
+        # n_weighted_rows is the total weight of the rows when fitting with the number of occurrences as weights
+        if self.tree_method == 'hist':
+            return HistogramTree(min_samples_leaf=self.k, is_regression=self.is_regression)
+        if n_weighted_rows is None:
+            params = {'min_samples_split': 2, 'min_samples_leaf': self.k}
+        elif 2 * self.k > n_weighted_rows:
+            # no split can leave k records on both sides
+            params = {'min_samples_split': max(n_rows + 1, 2)}
+        else:
+            # weights are whole numbers, so a leaf weight of at least k - 0.5 means at least k records
+            params = {'min_samples_split': 2, 'min_weight_fraction_leaf': (self.k - 0.5) / n_weighted_rows}
+        if self.is_regression:
+            return DecisionTreeRegressor(random_state=10, **params)
+        return DecisionTreeClassifier(random_state=10, **params)
+
+    def _deduplicate(self, x, y):
+        # groups rows with the same values in the features used to train the anonymizer tree and the same label.
+        # returns the first row of each group, the group of each row and the number of rows in each group
+        columns = self._quasi_identifiers if self.train_only_QI else self.features
+        rows = pd.DataFrame(x[:, columns])
+        rows['label'] = y
+        row_groups = rows.groupby(list(rows.columns), sort=False, dropna=False).ngroup().to_numpy()
+        unique_rows = np.unique(row_groups, return_index=True)[1]
+        return unique_rows, row_groups, np.bincount(row_groups)
+
+    def _prepare_data(self, x):
+        # x is original data, returns the data used to train and apply the anonymizer tree
+        with self._phase('encoding', x.shape[0]):
+            if self._preprocessor is not None:
+                x = self._preprocessor.transform(x)
+            return self._train_features(x)
+
+    def _train_features(self, x_prepared):
+        # encoded data already holds just the QI features
+        if self.train_only_QI and self._preprocessor is None:
+            # build DT just on QI features
+            return x_prepared[:, self._quasi_identifiers]
+        return x_prepared
+
+    def _calculate_cells(self):
+        with self._phase('calculate_cells', 0) as stats:
+            tree = self._anonymizer.tree_
+            self._nodes = np.flatnonzero(tree.feature == -2)  # leaf nodes
+            # maps a node id to its row in the cell table (-1 for inner nodes)
+            self._cell_index = np.full(tree.node_count, -1, dtype=np.intp)
+            self._cell_index[self._nodes] = np.arange(len(self._nodes))
+            stats.leaves = len(self._nodes)
+
+    def _find_representatives(self, x, cell_ids, n_cells):
+        # x is original data, cell_ids is the row in the cell table each row of x belongs to
+        # returns the cell table: one row per cell, one column per quasi-identifier
+        with self._phase('find_representatives', x.shape[0]) as stats:
+            stats.leaves = n_cells
+            return self._find_segment_representatives(x, cell_ids, n_cells)
+
+    def _find_segment_representatives(self, x, cell_ids, n_cells):
+        # sort rows by cell once, so that each cell becomes a contiguous segment (original row order is kept
+        # inside each segment)
+        order = np.argsort(cell_ids, kind='stable')
+        sorted_cell_ids = cell_ids[order]
+        sizes = np.bincount(cell_ids, minlength=n_cells)
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        # cell means of integer data are not integers
+        dtype = float if self.representative == 'mean' and x.dtype.kind in 'biu' else x.dtype
+        representatives = np.empty((n_cells, len(self._quasi_identifiers)), dtype=dtype)
+        # TODO: should we filter only those with majority label? (using hist)
+        for i, feature in enumerate(self._quasi_identifiers):
+            values = x[order, feature]
+            if self._categorical_features and feature in self._categorical_features:
+                representatives[:, i] = self._segment_mode(values, sorted_cell_ids, n_cells)
+            elif self.representative == 'mean':
+                representatives[:, i] = np.add.reduceat(values.astype(float), starts) / sizes
+            else:
+                representatives[:, i] = self._segment_closest_to_median(values, sorted_cell_ids, starts, sizes)
+        return representatives
+
+    @staticmethod
+    def _segment_closest_to_median(values, cell_ids, starts, sizes):
+        # value closest to the median of each cell, ties go to the first row of the cell
+        numeric = values.astype(float)
+        ordered = numeric[np.lexsort((numeric, cell_ids))]
+        median = (ordered[starts + (sizes - 1) // 2] + ordered[starts + sizes // 2]) / 2
+        median[np.add.reduceat(np.isnan(numeric), starts) > 0] = np.nan
+        dist = np.abs(numeric - median[cell_ids])
+        return values[np.lexsort((dist, cell_ids))[starts]]
+
+    @staticmethod
+    def _segment_mode(values, cell_ids, n_cells):
+        # most common value of each cell, ties go to the value that appears first in the cell
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        keys = cell_ids.astype(np.int64) * len(uniques) + codes
+        unique_keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        key_cells = unique_keys // len(uniques)
+        best = np.lexsort((first, -counts, key_cells))
+        best = best[np.searchsorted(key_cells[best], np.arange(n_cells))]
+        return values[first[best]]
 
     def _find_sample_nodes(self, samples):
-        paths = self._anonymizer.decision_path(samples).toarray()
-        node_set = set(self._nodes)
-        return [(list(set([i for i, v in enumerate(p) if v == 1]) & node_set))[0] for p in paths]
-
-    def _find_sample_cells(self, samples, cells_by_id):
-        node_ids = self._find_sample_nodes(samples)
-        return [cells_by_id[node_id] for node_id in node_ids]
-
-    def _anonymize_data(self, x, x_anonymizer_train, cells_by_id):
-        cells = self._find_sample_cells(x_anonymizer_train, cells_by_id)
-        index = 0
-        for row in x:
-            cell = cells[index]
-            index += 1
-            for feature in cell['representative']:
-                row[feature] = cell['representative'][feature]
-        return x
+        # id of the leaf node each sample falls into
+        with self._phase('apply', samples.shape[0]):
+            return self._anonymizer.apply(samples)
+
+    def _anonymize_data(self, x, node_ids):
+        return self._write_representatives(x, self._cell_index[node_ids], self._representatives)
+
+    def _write_representatives(self, x, cell_ids, representatives):
+        with self._phase('anonymize_data', x.shape[0]):
+            # integer data is upcast to hold float representatives
+            x = x.astype(np.result_type(x.dtype, representatives.dtype), copy=False)
+            for i, feature in enumerate(self._quasi_identifiers):
+                x[:, feature] = representatives[cell_ids, i]
+            return x
+
+    @contextmanager
+    def _phase(self, name, rows):
+        # records the wall time, peak traced memory and number of rows of a phase, phases should not be nested
+        stats = self._stats.setdefault(name, PhaseStats())
+        start_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        elif self.trace_memory and hasattr(tracemalloc, 'reset_peak'):
+            # tracing was already running, the peak must not include earlier phases (Python >= 3.9)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.wall_time += time.perf_counter() - start
+            stats.rows += rows
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                stats.peak_memory = peak if stats.peak_memory is None else max(stats.peak_memory, peak)
+            if start_tracing:
+                tracemalloc.stop()
+        if self.stats_callback is not None:
+            self.stats_callback(name, stats)
+
+    def _merge_leaves(self, leaf_counts, k):
+        # merges leaves bottom-up so that each cell contains at least k rows, returns the cell of each leaf node
+        # (-1 for inner nodes). leaf_counts is the number of rows in each node (0 for inner nodes).
+        tree = self._anonymizer.tree_
+        if leaf_counts.sum() < k:
+            raise ValueError('The data contains less than %d records' % k)
+        # leaves are merged by pointing them to another leaf of the same cell
+        parent = np.arange(tree.node_count)
+        size = leaf_counts.copy()
+        # per node: the leaf holding its rows that are not in a cell of at least k rows yet, and the smallest cell of
+        # at least k rows in its subtree
+        pending = np.full(tree.node_count, -1, dtype=np.intp)
+        smallest = np.full(tree.node_count, -1, dtype=np.intp)
+        # children always have higher ids than their parent
+        for node in range(tree.node_count - 1, -1, -1):
+            if tree.feature[node] == -2:  # leaf node
+                if leaf_counts[node] >= k:
+                    smallest[node] = node
+                else:
+                    pending[node] = node
+                continue
+            left = tree.children_left[node]
+            right = tree.children_right[node]
+            # merge the undersized rows of both children
+            node_pending = pending[left]
+            if node_pending < 0:
+                node_pending = pending[right]
+            elif pending[right] >= 0:
+                parent[pending[right]] = node_pending
+                size[node_pending] += size[pending[right]]
+            node_smallest = smallest[left]
+            if node_smallest < 0 or (smallest[right] >= 0 and size[smallest[right]] < size[node_smallest]):
+                node_smallest = smallest[right]
+            if node_pending >= 0:
+                if size[node_pending] >= k:
+                    # undersized rows are enough for a cell of their own
+                    if node_smallest < 0 or size[node_pending] < size[node_smallest]:
+                        node_smallest = node_pending
+                    node_pending = -1
+                elif node_smallest >= 0:
+                    # add the undersized rows to the smallest cell of this subtree
+                    parent[node_pending] = node_smallest
+                    size[node_smallest] += size[node_pending]
+                    node_pending = -1
+            pending[node] = node_pending
+            smallest[node] = node_smallest
+        while (parent[parent] != parent).any():
+            parent = parent[parent]
+        leaf_cells = np.full(tree.node_count, -1, dtype=np.intp)
+        leaf_cells[self._nodes] = np.unique(parent[self._nodes], return_inverse=True)[1]
+        return leaf_cells
 
     def _modify_categorical_features(self, x):
         # prepare data for DT
         used_features = self.features
         if self.train_only_QI:
-            used_features = self.quasi_identifiers
-        numeric_features = [f for f in self.features if f in used_features and f not in self.categorical_features]
-        categorical_features = [f for f in self.categorical_features if f in used_features]
+            used_features = self._quasi_identifiers
+        numeric_features = [f for f in self.features if f in used_features and f not in self._categorical_features]
+        categorical_features = [f for f in self._categorical_features if f in used_features]
         numeric_transformer = Pipeline(
             steps=[('imputer', SimpleImputer(strategy='constant', fill_value=0))]
         )
-        categorical_transformer = OneHotEncoder(handle_unknown="ignore", sparse=False)
+        if self._categorical_encoding == 'ordinal':
+            categorical_transformer = OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1)
+        else:
+            categorical_transformer = OneHotEncoder(handle_unknown="ignore")
+        # keep one-hot encoded data sparse (CSR), the anonymizer tree is trained and applied on it as is
         preprocessor = ColumnTransformer(
             transformers=[
                 ("num", numeric_transformer, numeric_features),
                 ("cat", categorical_transformer, categorical_features),
-            ]
+            ],
+            sparse_threshold=1.0
         )
         encoded = preprocessor.fit_transform(x)
+        self._preprocessor = preprocessor
         return encoded
@@ -0,0 +1,73 @@
+"""
+Dictionary-encoded representation of anonymized data.
+"""
+import numpy as np
+import pandas as pd
+
+from typing import Union
+
+
+class CompactAnonymizedData:
+    """
+    Anonymized data stored as the cell each record belongs to plus a table of the representative values of each
+    cell, instead of a full copy of the data. All records of a cell share the same quasi-identifier values, so this
+    takes much less memory than the materialized data. Columns that are not quasi-identifiers are not copied, they
+    are read from the original samples when needed.
+
+    :param samples: The original (not anonymized) samples, shape (n_samples, n_features).
+    :type samples: np.ndarray
+    :param cell_ids: The cell (row of ``representatives``) each record belongs to, shape (n_samples,).
+    :type cell_ids: np.ndarray
+    :param representatives: The representative values of each cell, shape (n_cells, n_quasi_identifiers).
+    :type representatives: np.ndarray
+    :param quasi_identifiers: Indexes of the quasi-identifier columns in ``samples``, in the order of the columns of
+                              ``representatives``.
+    :type quasi_identifiers: list
+    :param features_names: The feature names, in the order that they appear in the data.
+    :type features_names: list
+    :param is_pandas: Whether the original data was a pandas DataFrame.
+    :type is_pandas: boolean
+    """
+
+    def __init__(self, samples: np.ndarray, cell_ids: np.ndarray, representatives: np.ndarray,
+                 quasi_identifiers: list, features_names: list, is_pandas: bool):
+        self.samples = samples
+        self.cell_ids = cell_ids
+        self.representatives = representatives
+        self.quasi_identifiers = quasi_identifiers
+        self.features_names = features_names
+        self.is_pandas = is_pandas
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    def materialize(self) -> Union[np.ndarray, pd.DataFrame]:
+        """
+        Build the full anonymized data.
+
+        :return: The anonymized data as either numpy array or pandas DataFrame (depending on the type of the original
+                 data).
+        """
+        x = self.samples.copy()
+        for i, feature in enumerate(self.quasi_identifiers):
+            x[:, feature] = self.representatives[self.cell_ids, i]
+        if self.is_pandas:
+            return pd.DataFrame(x, columns=self.features_names)
+        return x
+
+    def to_pandas(self) -> pd.DataFrame:
+        """
+        Build a pandas DataFrame of the anonymized data in which each quasi-identifier column is categorical, with
+        the distinct representative values as categories. This takes one small integer code per record and
+        quasi-identifier.
+
+        :return: The anonymized data as a pandas DataFrame.
+        """
+        columns = {}
+        for feature, name in enumerate(self.features_names):
+            if feature in self.quasi_identifiers:
+                codes, categories = pd.factorize(self.representatives[:, self.quasi_identifiers.index(feature)])
+                columns[name] = pd.Categorical.from_codes(codes[self.cell_ids], categories)
+            else:
+                columns[name] = self.samples[:, feature]
+        return pd.DataFrame(columns)
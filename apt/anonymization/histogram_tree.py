@@ -0,0 +1,259 @@
+"""
+Histogram-based decision tree, used as a faster anonymizer model for large datasets.
+"""
+import numpy as np
+from scipy.sparse import issparse
+
+from typing import Optional
+
+# maximum number of (sample, feature) entries whose histograms are computed at once
+HISTOGRAM_BLOCK_SIZE = 1 << 22
+
+
+class TreeStructure:
+    """
+    Array representation of a fitted tree, following the layout of the ``tree_`` attribute of scikit-learn trees.
+    Node 0 is the root, leaves have feature -2 and children -1.
+
+    :param feature: The feature used for splitting each node.
+    :type feature: np.ndarray
+    :param threshold: The threshold of each split. Samples with feature value <= threshold go to the left child.
+    :type threshold: np.ndarray
+    :param children_left: The left child of each node.
+    :type children_left: np.ndarray
+    :param children_right: The right child of each node.
+    :type children_right: np.ndarray
+    :param n_node_samples: The number of training samples reaching each node.
+    :type n_node_samples: np.ndarray
+    :param weighted_n_node_samples: The sum of the weights of the training samples reaching each node.
+    :type weighted_n_node_samples: np.ndarray
+    :param value: Class counts (classification) or mean target (regression) of each node, shape
+                  (node_count, 1, n_classes) or (node_count, 1, 1).
+    :type value: np.ndarray
+    """
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, children_left: np.ndarray,
+                 children_right: np.ndarray, n_node_samples: np.ndarray, weighted_n_node_samples: np.ndarray,
+                 value: np.ndarray):
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.n_node_samples = n_node_samples
+        self.weighted_n_node_samples = weighted_n_node_samples
+        self.value = value
+        self.node_count = len(feature)
+
+
+class HistogramTree:
+    """
+    Decision tree that pre-bins each feature into at most ``max_bins`` quantile bins and finds splits on per-node
+    histograms of the bins. The ``min_samples_leaf`` constraint is enforced on the bin counts, so each leaf of the
+    fitted tree contains at least ``min_samples_leaf`` training samples. When fitted with sample weights (e.g., the
+    number of occurrences of each distinct record), the constraint is enforced on the sum of the weights.
+
+    Exposes the parts of the scikit-learn tree interface used by `Anonymize`: ``fit``, ``apply``, ``predict`` and
+    ``tree_``. Classification trees use the gini criterion and regression trees the squared error. Sparse input (e.g.,
+    one-hot encoded categorical features) is binned one column at a time and is never densified.
+
+    :param min_samples_leaf: The minimum number of samples in each leaf.
+    :type min_samples_leaf: int
+    :param max_bins: The maximum number of bins per feature, between 2 and 256. Default is 256.
+    :type max_bins: int, optional
+    :param is_regression: Whether to fit a regression tree (if False, fits a classification tree). Default is False.
+    :type is_regression: boolean, optional
+    """
+
+    def __init__(self, min_samples_leaf: int, max_bins: Optional[int] = 256, is_regression: Optional[bool] = False):
+        if min_samples_leaf < 1:
+            raise ValueError("min_samples_leaf should be a positive integer")
+        if max_bins < 2 or max_bins > 256:
+            raise ValueError("max_bins should be between 2 and 256")
+        self.min_samples_leaf = min_samples_leaf
+        self.max_bins = max_bins
+        self.is_regression = is_regression
+        self.tree_ = None
+
+    def fit(self, x: np.ndarray, y: np.ndarray, sample_weight: Optional[np.ndarray] = None):
+        """
+        Fit the tree.
+
+        :param x: The training samples, shape (n_samples, n_features).
+        :type x: np.ndarray or sparse matrix
+        :param y: The target values, shape (n_samples,).
+        :type y: np.ndarray
+        :param sample_weight: Sample weights, shape (n_samples,). If None, all samples have weight 1.
+        :type sample_weight: np.ndarray, optional
+        :return: self
+        """
+        x = self._check_input(x)
+        y = np.asarray(y)
+        if x.shape[0] != y.shape[0]:
+            raise ValueError("x and y should have same number of rows")
+        if sample_weight is not None:
+            sample_weight = np.asarray(sample_weight, dtype=float)
+            if sample_weight.shape != y.shape:
+                raise ValueError("sample_weight should have one weight per sample")
+        # sparse columns are extracted one at a time from a column-major copy
+        columns = x.tocsc() if issparse(x) else x
+        self._bin_edges = []
+        bins = np.empty(x.shape, dtype=np.uint8)
+        for feature in range(x.shape[1]):
+            values = columns[:, feature].toarray().ravel() if issparse(columns) else columns[:, feature]
+            self._bin_edges.append(self._find_bin_edges(values))
+            bins[:, feature] = np.searchsorted(self._bin_edges[feature], values, side='left')
+        if self.is_regression:
+            y = y.astype(float)
+        else:
+            self.classes_, y = np.unique(y, return_inverse=True)
+        self.tree_ = self._grow(bins, y, sample_weight)
+        return self
+
+    def apply(self, x: np.ndarray) -> np.ndarray:
+        """
+        Return the index of the leaf that each sample is predicted as.
+
+        :param x: The input samples, shape (n_samples, n_features).
+        :type x: np.ndarray or sparse matrix
+        :return: Leaf node id of each sample, shape (n_samples,).
+        """
+        x = self._check_input(x)
+        tree = self.tree_
+        node_ids = np.zeros(x.shape[0], dtype=np.intp)
+        active = np.arange(x.shape[0]) if tree.feature[0] != -2 else np.empty(0, dtype=np.intp)
+        # move all samples one level down at a time, until they all reach a leaf
+        while active.size:
+            nodes = node_ids[active]
+            values = x[active, tree.feature[nodes]]
+            if issparse(x):
+                values = np.asarray(values).ravel()
+            go_left = values <= tree.threshold[nodes]
+            node_ids[active] = np.where(go_left, tree.children_left[nodes], tree.children_right[nodes])
+            active = active[tree.feature[node_ids[active]] != -2]
+        return node_ids
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        """
+        Predict the class or target value of samples.
+
+        :param x: The input samples, shape (n_samples, n_features).
+        :type x: np.ndarray or sparse matrix
+        :return: Predictions, shape (n_samples,).
+        """
+        value = self.tree_.value[self.apply(x), 0]
+        if self.is_regression:
+            return value[:, 0]
+        return self.classes_[np.argmax(value, axis=1)]
+
+    @staticmethod
+    def _check_input(x):
+        # sparse input stays sparse, in row-major format for routing samples
+        if issparse(x):
+            return x.tocsr().astype(float)
+        return np.asarray(x, dtype=float)
+
+    def _find_bin_edges(self, values):
+        # samples with value <= edges[i] (and > edges[i - 1]) fall into bin i
+        unique = np.unique(values)
+        if len(unique) <= self.max_bins:
+            return unique[:-1]
+        quantiles = np.linspace(0, 1, self.max_bins + 1)[1:-1]
+        return np.unique(np.quantile(values, quantiles, method='lower'))
+
+    def _grow(self, bins, y, sample_weight):
+        feature, threshold, children_left, children_right, n_node_samples, value = [], [], [], [], [], []
+        weighted_n_node_samples = []
+        # depth-first, left child first, so that node ids follow the same order as in scikit-learn trees
+        stack = [(np.arange(bins.shape[0]), -1, True)]
+        while stack:
+            indexes, parent, is_left = stack.pop()
+            node = len(feature)
+            if parent >= 0:
+                if is_left:
+                    children_left[parent] = node
+                else:
+                    children_right[parent] = node
+            weights = sample_weight[indexes] if sample_weight is not None else None
+            n_node_samples.append(len(indexes))
+            weighted_n_node_samples.append(len(indexes) if weights is None else weights.sum())
+            if self.is_regression:
+                value.append([np.average(y[indexes], weights=weights)])
+            else:
+                value.append(np.bincount(y[indexes], weights=weights, minlength=len(self.classes_)))
+            split = self._find_split(bins[indexes], y[indexes], weights)
+            children_left.append(-1)
+            children_right.append(-1)
+            if split is None:
+                feature.append(-2)
+                threshold.append(-2.0)
+                continue
+            split_feature, split_bin = split
+            feature.append(split_feature)
+            threshold.append(self._bin_edges[split_feature][split_bin])
+            go_left = bins[indexes, split_feature] <= split_bin
+            stack.append((indexes[~go_left], node, False))
+            stack.append((indexes[go_left], node, True))
+        return TreeStructure(np.array(feature, dtype=np.intp), np.array(threshold, dtype=float),
+                             np.array(children_left, dtype=np.intp), np.array(children_right, dtype=np.intp),
+                             np.array(n_node_samples, dtype=np.intp), np.array(weighted_n_node_samples, dtype=float),
+                             np.array(value, dtype=float)[:, np.newaxis, :])
+
+    def _find_split(self, bins, y, weights):
+        # returns the (feature, bin) split with the lowest impurity such that samples with bin <= split bin go left,
+        # or None if the node should be a leaf. weights is None when all samples have weight 1.
+        n_samples = bins.shape[0] if weights is None else weights.sum()
+        if n_samples < 2 * self.min_samples_leaf or np.ptp(y) == 0:
+            return None
+        counts, sums = self._histograms(bins, y, weights)
+        n_left = np.cumsum(counts, axis=1)[:, :-1]
+        n_right = n_samples - n_left
+        valid = (n_left >= self.min_samples_leaf) & (n_right >= self.min_samples_leaf)
+        if not valid.any():
+            return None
+        if self.is_regression:
+            # squared error is minimized by maximizing sum_left^2 / n_left + sum_right^2 / n_right
+            sum_left = np.cumsum(sums, axis=1)[:, :-1]
+            sum_right = (y if weights is None else y * weights).sum() - sum_left
+            stats_left = sum_left ** 2
+            stats_right = sum_right ** 2
+        else:
+            # gini impurity is minimized by maximizing sum(counts_left^2) / n_left + sum(counts_right^2) / n_right
+            left = np.cumsum(sums, axis=1)[:, :-1]
+            right = np.bincount(y, weights=weights, minlength=len(self.classes_)) - left
+            stats_left = (left.astype(float) ** 2).sum(axis=2)
+            stats_right = (right.astype(float) ** 2).sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = stats_left / n_left + stats_right / n_right
+        score[~valid] = -np.inf
+        split_feature, split_bin = np.unravel_index(np.argmax(score), score.shape)
+        return int(split_feature), int(split_bin)
+
+    def _histograms(self, bins, y, weights):
+        # returns the (weighted) number of samples in each (feature, bin), shape (n_features, max_bins), and the sum of
+        # their (weighted) targets for regression or their (weighted) class counts for classification, shape
+        # (n_features, max_bins) or (n_features, max_bins, n_classes). features are processed in blocks, so that the
+        # temporary (sample, feature) index arrays stay small when there are many features (e.g., one-hot encoded).
+        n_samples, n_features = bins.shape
+        n_outputs = 1 if self.is_regression else len(self.classes_)
+        block_size = max(1, HISTOGRAM_BLOCK_SIZE // max(n_samples, 1))
+        counts = np.empty((n_features, self.max_bins))
+        sums = np.empty((n_features, self.max_bins, n_outputs))
+        weighted_y = y if weights is None or not self.is_regression else y * weights
+        for start in range(0, n_features, block_size):
+            block = bins[:, start:start + block_size]
+            size = block.shape[1] * self.max_bins
+            # histogram index of each (sample, feature), and the weight of each of them
+            offsets = block.astype(np.intp) + np.arange(block.shape[1]) * self.max_bins
+            offset_weights = np.repeat(weights, block.shape[1]) if weights is not None else None
+            counts[start:start + block.shape[1]] = np.bincount(offsets.ravel(), weights=offset_weights,
+                                                               minlength=size).reshape(-1, self.max_bins)
+            if self.is_regression:
+                block_sums = np.bincount(offsets.ravel(), weights=np.repeat(weighted_y, block.shape[1]),
+                                         minlength=size)
+            else:
+                class_offsets = offsets * n_outputs + y[:, np.newaxis]
+                block_sums = np.bincount(class_offsets.ravel(), weights=offset_weights, minlength=size * n_outputs)
+            sums[start:start + block.shape[1]] = block_sums.reshape(-1, self.max_bins, n_outputs)
+        if self.is_regression:
+            return counts, sums[:, :, 0]
+        return counts, sums
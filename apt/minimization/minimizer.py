@@ -108,6 +108,7 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
         self._feature_data = None
         self._categorical_values = {}
         self._dt = None
+        self._level_ancestors = {}
         self._features = None
         self._level = 0
 
@@ -321,6 +322,7 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
             self._encode_categorical_features(used_data, save_mapping=True)
             x_prepared = self._encode_categorical_features(used_x_train)
             self._dt.fit(x_prepared, y_train)
+            self._level_ancestors = {}
             x_prepared_test = self._encode_categorical_features(used_x_test)
 
             self._calculate_cells()
@@ -336,7 +338,7 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
             # self._cells currently holds the generalization created from the tree leaves
             self._calculate_generalizations(x_test)
             if self.generalize_using_transform:
-                generalized = self._generalize_from_tree(x_test, x_prepared_test, nodes, self.cells, self._cells_by_id)
+                generalized = self._generalize_from_tree(x_test, x_prepared_test, nodes, self.cells)
             else:
                 generalized = self._generalize_from_generalizations(x_test, self.generalizations)
 
@@ -366,8 +368,7 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
 
                     self._calculate_generalizations(x_test)
                     if self.generalize_using_transform:
-                        generalized = self._generalize_from_tree(x_test, x_prepared_test, nodes, self.cells,
-                                                                 self._cells_by_id)
+                        generalized = self._generalize_from_tree(x_test, x_prepared_test, nodes, self.cells)
                     else:
                         generalized = self._generalize_from_generalizations(x_test, self.generalizations)
 
@@ -397,8 +398,7 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
 
                     self._calculate_generalizations(x_test)
                     if self.generalize_using_transform:
-                        generalized = self._generalize_from_tree(x_test, x_prepared_test, nodes, self.cells,
-                                                                 self._cells_by_id)
+                        generalized = self._generalize_from_tree(x_test, x_prepared_test, nodes, self.cells)
                     else:
                         generalized = self._generalize_from_generalizations(x_test, self.generalizations)
                     accuracy = self.estimator.score(ArrayDataset(self.encoder.transform(generalized).astype(dtype),
@@ -518,7 +518,7 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
             if self.train_only_features_to_minimize:
                 used_x = QI
             prepared = self._encode_categorical_features(used_x)
-            generalized = self._generalize_from_tree(x_pd, prepared, nodes, self.cells, self._cells_by_id)
+            generalized = self._generalize_from_tree(x_pd, prepared, nodes, self.cells)
         else:
             mapped = np.zeros(x_pd.shape[0])  # to mark records we already mapped
             all_indexes = []
@@ -824,7 +824,7 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
         for cell in self.cells:
             cell['representative'] = {}
             # get all rows in cell
-            indexes = [i for i, x in enumerate(nodeIds) if x == cell['id']]
+            indexes = np.flatnonzero(nodeIds == cell['id'])
             original_rows = originalTrainFeatures.iloc[indexes]
             sample_rows = prepared_data.iloc[indexes]
             sample_labels = labels_df.iloc[indexes]['label'].values.tolist()
@@ -856,9 +856,27 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
                 cell['representative'][feature] = row[feature]
 
     def _find_sample_nodes(self, samples, nodes):
-        paths = self._dt.decision_path(samples).toarray()
-        nodeSet = set(nodes)
-        return [(list(set([i for i, v in enumerate(p) if v == 1]) & nodeSet))[0] for p in paths]
+        # the node of each sample in nodes is the level ancestor of the leaf it falls in
+        return self._get_level_ancestors(nodes)[self._dt.apply(samples)]
+
+    def _get_level_ancestors(self, nodes):
+        # maps each node of the tree to its ancestor (or itself) in nodes, -1 for nodes above them.
+        # computed once per level, by going down the tree from nodes one depth at a time
+        key = tuple(nodes)
+        if key not in self._level_ancestors:
+            tree = self._dt.tree_
+            ancestors = np.full(tree.node_count, -1, dtype=np.intp)
+            frontier = np.asarray(nodes, dtype=np.intp)
+            ancestors[frontier] = frontier
+            while frontier.size > 0:
+                parents = np.concatenate((frontier, frontier))
+                children = np.concatenate((tree.children_left[frontier], tree.children_right[frontier]))
+                # leaves have no children (-1)
+                is_node = children != -1
+                frontier = children[is_node]
+                ancestors[frontier] = ancestors[parents[is_node]]
+            self._level_ancestors[key] = ancestors
+        return self._level_ancestors[key]
 
     # method for applying generalizations (for global generalization-based acuuracy) without dt
     def _generalize_from_generalizations(self, original_data, generalizations):
@@ -882,13 +900,14 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
                         rows[feature] = generalizations['range_representatives'][feature][r_index]
         return original_data_generalized
 
-    def _generalize_from_tree(self, original_data, prepared_data, level_nodes, cells, cells_by_id):
-        mapping_to_cells = self._map_to_cells(prepared_data, level_nodes, cells_by_id)
-        all_indexes = []
-        for i in range(len(cells)):
-            # get the indexes of all records that map to this cell
-            indexes = [j for j in mapping_to_cells if mapping_to_cells[j]['id'] == cells[i]['id']]
-            all_indexes.append(indexes)
+    def _generalize_from_tree(self, original_data, prepared_data, level_nodes, cells):
+        cell_indexes = self._map_to_cells(prepared_data, level_nodes, cells)
+        if (cell_indexes < 0).any():
+            raise KeyError('Some records map to tree nodes that have no cell')
+        # get the indexes of all records that map to each cell, by sorting the records by cell once
+        order = np.argsort(cell_indexes, kind='stable')
+        bounds = np.searchsorted(cell_indexes[order], np.arange(len(cells) + 1))
+        all_indexes = [prepared_data.index[order[bounds[i]:bounds[i + 1]]].tolist() for i in range(len(cells))]
         return self._generalize_indexes(original_data, cells, all_indexes)
 
     def _generalize_indexes(self, original_data, cells, all_indexes):
@@ -948,16 +967,11 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
             all_sample_indexes.append(sample_indexes)
         return all_sample_indexes
 
-    def _map_to_cells(self, samples, nodes, cells_by_id):
-        mapping_to_cells = {}
-        for index, row in samples.iterrows():
-            cell = self._find_sample_cells([row], nodes, cells_by_id)[0]
-            mapping_to_cells[index] = cell
-        return mapping_to_cells
-
-    def _find_sample_cells(self, samples, nodes, cells_by_id):
-        node_ids = self._find_sample_nodes(samples, nodes)
-        return [cells_by_id[nodeId] for nodeId in node_ids]
+    def _map_to_cells(self, samples, nodes, cells):
+        # returns the position in cells of the cell of each sample
+        cell_index_by_node = np.full(self._dt.tree_.node_count, -1, dtype=np.intp)
+        cell_index_by_node[[cell['id'] for cell in cells]] = np.arange(len(cells))
+        return cell_index_by_node[self._find_sample_nodes(samples, nodes)]
 
     def _remove_feature_from_generalization(self, original_data, prepared_data, nodes, labels, feature_data,
                                             current_accuracy, generalize_using_transform):
@@ -996,10 +1010,8 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
                 if feature_ncp > 0:
                     # divide by accuracy gain
                     new_cells = copy.deepcopy(self.cells)
-                    cells_by_id = copy.deepcopy(self._cells_by_id)
-                    GeneralizeToRepresentative._remove_feature_from_cells(new_cells, cells_by_id, feature)
-                    generalized = self._generalize_from_tree(original_data, prepared_data, nodes, new_cells,
-                                                             cells_by_id)
+                    GeneralizeToRepresentative._remove_feature_from_cells(new_cells, None, feature)
+                    generalized = self._generalize_from_tree(original_data, prepared_data, nodes, new_cells)
                     accuracy_gain = self.estimator.score(ArrayDataset(self.encoder.transform(generalized),
                                                                       labels)) - current_accuracy
                     if accuracy_gain < 0:
@@ -1023,10 +1035,8 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
                 if feature_ncp > 0:
                     # divide by accuracy loss
                     new_cells = copy.deepcopy(self.cells)
-                    cells_by_id = copy.deepcopy(self._cells_by_id)
-                    GeneralizeToRepresentative._remove_feature_from_cells(new_cells, cells_by_id, feature)
-                    generalized = self._generalize_from_tree(original_data, prepared_data, nodes, new_cells,
-                                                             cells_by_id)
+                    GeneralizeToRepresentative._remove_feature_from_cells(new_cells, None, feature)
+                    generalized = self._generalize_from_tree(original_data, prepared_data, nodes, new_cells)
                     accuracy_gain = self.estimator.score(ArrayDataset(self.encoder.transform(generalized),
                                                                       labels)) - current_accuracy
 
@@ -1267,7 +1277,9 @@ class GeneralizeToRepresentative(BaseEstimator, MetaEstimatorMixin, TransformerM
             elif feature in cell['categories'].keys():
                 del cell['categories'][feature]
             cell['untouched'].append(feature)
-            cells_by_id[cell['id']] = cell.copy()
+            # cells_by_id is None for temporary copies of the cells that have no index
+            if cells_by_id is not None:
+                cells_by_id[cell['id']] = cell.copy()
 
     @staticmethod
     def _remove_categorical_untouched(generalizations):
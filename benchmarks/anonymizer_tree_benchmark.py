@@ -0,0 +1,40 @@
+"""
+Compares the exact (scikit-learn) and histogram anonymizer trees of `Anonymize` on synthetic data: fit time, number
+of cells, and the accuracy of a model retrained on the anonymized data.
+
+Usage (from the repository root): PYTHONPATH=. python benchmarks/anonymizer_tree_benchmark.py [n_samples] [n_features]
+"""
+import sys
+import time
+
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+from apt.anonymization import Anonymize
+from apt.utils.datasets import ArrayDataset
+
+
+def main(n_samples=500000, n_features=20, k_values=(5, 20, 100)):
+    x, y = make_classification(n_samples, n_features, n_informative=n_features // 2, random_state=0)
+    x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=0.2, random_state=0)
+    model = RandomForestClassifier(n_estimators=20, n_jobs=-1, random_state=0)
+    model.fit(x_train, y_train)
+    pred = model.predict(x_train)
+    print('Base model accuracy: %.4f' % model.score(x_test, y_test))
+    qi = list(range(n_features))
+
+    print('%6s %6s %10s %8s %10s' % ('k', 'tree', 'fit time', 'cells', 'accuracy'))
+    for k in k_values:
+        for tree_method in ('exact', 'hist'):
+            anonymizer = Anonymize(k, qi, tree_method=tree_method)
+            start = time.perf_counter()
+            anon = anonymizer.anonymize(ArrayDataset(x_train, pred))
+            elapsed = time.perf_counter() - start
+            model.fit(anon, y_train)
+            accuracy = model.score(x_test, y_test)
+            print('%6d %6s %9.2fs %8d %10.4f' % (k, tree_method, elapsed, len(anonymizer._nodes), accuracy))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -3,16 +3,26 @@ This module implements k-anonymity, l-diversity, and t-closeness methods.
 Currently, it only supports numerical values as quasi-identifiers.
 """
 
+import json
+import numpy as np
 import pandas as pd
 import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from tabulate import tabulate
 
 class Mondrian:
     """
     Mondrian class for data anonymization using the Mondrian algorithm.
+
+    The quasi-identifier columns are held as one contiguous NumPy matrix (categorical columns as their integer codes),
+    and partitions are contiguous ranges of a permutation of the row positions, so splitting a partition only
+    reorders the rows of its range. The sensitive column is factorized once, so that l-diversity and t-closeness are
+    checked on per-partition histograms of the sensitive values.
     """
 
-    def __init__(self, df, feature_columns, sensitive_column=None):
+    def __init__(self, df, feature_columns, sensitive_column=None, median_sample_size=None, random_state=None):
         """
         Initialize the Mondrian instance.
 
@@ -20,12 +30,30 @@ class Mondrian:
             df (pandas.DataFrame): The input DataFrame.
             feature_columns (list): A list of column names containing the feature attributes.
             sensitive_column (str, optional): The name of the column containing sensitive information.
+            median_sample_size (int, optional): If set, partitions with more rows than this are first split around a
+                median estimated from a random sample of this many rows, instead of the exact median. If the split
+                around the estimated median does not satisfy the privacy requirements, the exact median is used.
+            random_state (int, optional): Seed for sampling the rows used to estimate medians.
         """
         self.df = df
         self.feature_columns = feature_columns
         self.sensitive_column = sensitive_column
-
-    def is_valid(self, partition, k=2, l=0, t=0.0):
+        self.median_sample_size = median_sample_size
+        self.random_state = random_state
+        self.is_categorical = np.array([df[column].dtype.name == "category" for column in feature_columns], dtype=bool)
+        self.data = np.empty((len(df), len(feature_columns)), dtype=np.float64)
+        for i, column in enumerate(feature_columns):
+            if self.is_categorical[i]:
+                self.data[:, i] = df[column].cat.codes
+            else:
+                self.data[:, i] = df[column]
+        self.sensitive_codes = None
+        if sensitive_column is not None:
+            self.sensitive_codes, sensitive_values = pd.factorize(df[sensitive_column], use_na_sentinel=False)
+            self.global_hist = np.bincount(self.sensitive_codes, minlength=len(sensitive_values))
+            self.global_freqs = self.global_hist / float(len(df))
+
+    def is_valid(self, partition, k=2, l=0, t=0.0, diversity="distinct"):
         """
         Check if a partition satisfies k-anonymity, l-diversity, and t-closeness.
 
@@ -34,23 +62,55 @@ class Mondrian:
             k (int): The desired k-anonymity value.
             l (int): The desired l-diversity value.
             t (float): The maximum allowed t-closeness distance.
+            diversity (str): 'distinct' for distinct l-diversity or 'entropy' for entropy l-diversity.
 
         Returns:
             bool: True if the partition satisfies privacy requirements, False otherwise.
         """
+        hist = self._sensitive_histogram(self._positions(partition))
+        return self._is_valid_histogram(len(partition), hist, k, l, t, diversity)
+
+    def sensitive_histogram(self, partition):
+        """
+        Count the occurrences of each sensitive value within a partition.
+
+        Parameters:
+            partition (pandas.Index): The partition.
+
+        Returns:
+            numpy.ndarray: The number of rows of the partition with each sensitive value, or None if there is no
+            sensitive column.
+        """
+        return self._sensitive_histogram(self._positions(partition))
+
+    def _positions(self, partition):
+        # returns the row positions of the labels of a partition
+        positions = self.df.index.get_indexer(partition)
+        if (positions < 0).any():
+            raise KeyError("partition contains labels that are not in the DataFrame")
+        return positions
+
+    def _sensitive_histogram(self, rows):
+        # sensitive_histogram of the rows at the given positions
+        if self.sensitive_codes is None:
+            return None
+        return np.bincount(self.sensitive_codes[rows], minlength=len(self.global_hist))
+
+    def _is_valid_histogram(self, size, hist, k, l, t, diversity):
         # k-anonymous
-        if not is_k_anonymous(partition, k):
+        if size < k:
             return False
         # l-diverse
-        if l > 0 and self.sensitive_column is not None:
-            diverse = is_l_diverse(self.df, partition, self.sensitive_column, l)
+        if l > 0 and hist is not None:
+            if diversity == "entropy":
+                diverse = is_entropy_l_diverse_histogram(hist, l)
+            else:
+                diverse = np.count_nonzero(hist) >= l
             if not diverse:
                 return False
         # t-closeness
-        if t > 0.0 and self.sensitive_column is not None:
-            global_freqs = get_global_freq(self.df, self.sensitive_column)
-            close = is_t_close(self.df, partition, self.sensitive_column, global_freqs, t)
-            if not close:
+        if t > 0.0 and hist is not None:
+            if not is_t_close_histogram(hist, self.global_freqs, t):
                 return False
         return True
 
@@ -65,19 +125,24 @@ class Mondrian:
         Returns:
             dict: A dictionary mapping feature column names to their spans.
         """
-        spans = {}
-        for column in self.feature_columns:
-            # for categorical columns, the unique number of values in the column is considered as the span
-            if self.df[column].dtype.name == "category":
-                span = len(self.df[column][partition].unique())
-            # for numerical columns, the difference between max and min is considered as the span of the column
-            else:
-                span = (
-                    self.df[column][partition].max() - self.df[column][partition].min()
-                )
-            if scale is not None:
-                span = span / scale[column]
-            spans[column] = span
+        if scale is not None:
+            scale = np.array([scale[column] for column in self.feature_columns], dtype=np.float64)
+        spans = self._block_spans(self.data[self._positions(partition)], scale)
+        return dict(zip(self.feature_columns, spans.tolist()))
+
+    def _block_spans(self, block, scale=None):
+        # the span of each feature column of the rows of block, in the order of feature_columns
+        spans = np.empty(block.shape[1], dtype=np.float64)
+        # for numerical columns, the difference between max and min is considered as the span of the column
+        numerical = ~self.is_categorical
+        if numerical.any():
+            spans[numerical] = np.ptp(block[:, numerical], axis=0)
+        # for categorical columns, the unique number of values in the column is considered as the span
+        for i in np.flatnonzero(self.is_categorical):
+            spans[i] = len(np.unique(block[:, i]))
+        if scale is not None:
+            # columns with a single value in the whole dataset can never be split
+            spans = spans / np.where(scale == 0, 1, scale)
         return spans
 
     def split(self, column, partition):
@@ -91,19 +156,33 @@ class Mondrian:
         Returns:
             tuple: Two partitions after the split.
         """
-        dfp = self.df[column][partition]
-        if dfp.dtype.name == "category":
-            values = dfp.unique()
-            lv = set(values[: len(values) // 2])
-            rv = set(values[len(values) // 2 :])
-            return dfp.index[dfp.isin(lv)], dfp.index[dfp.isin(rv)]
-        else:
-            median = dfp.median()
-            dfl = dfp.index[dfp < median]
-            dfr = dfp.index[dfp >= median]
-            return (dfl, dfr)
-
-    def partition(self, k=3, l=0, t=0.0):
+        rows = self._positions(partition)
+        i = self.feature_columns.index(column)
+        values = self.data[rows, i]
+        go_left = _split_mask(values, self._split_rule(values, self.is_categorical[i]), self.is_categorical[i])
+        return self.df.index[rows[go_left]], self.df.index[rows[~go_left]]
+
+    @staticmethod
+    def _split_rule(values, is_categorical):
+        # returns the codes of the categories that go to the left partition for categorical columns, or the value
+        # below which rows go to the left partition for numerical columns
+        if is_categorical:
+            # the first half of the categories, in order of appearance in the partition, go left
+            categories, first = np.unique(values, return_index=True)
+            categories = categories[np.argsort(first)]
+            return categories[: len(categories) // 2]
+        return _median(values)
+
+    @classmethod
+    def _candidate_split_rules(cls, values, is_categorical, median_sample_size, seed):
+        # yields the candidate splits of a partition on a column, from the cheapest one
+        if not is_categorical and median_sample_size is not None and len(values) > median_sample_size:
+            # the sample only depends on the seed and the partition, so parallel and serial splitting sample the same
+            sample = np.random.default_rng(seed).integers(0, len(values), median_sample_size)
+            yield _median(values[sample])
+        yield cls._split_rule(values, is_categorical)
+
+    def partition(self, k=3, l=0, t=0.0, diversity="distinct", n_jobs=1):
         """
         Partition the input dataset into k-anonymous partitions.
 
@@ -111,30 +190,495 @@ class Mondrian:
             k (int): The desired k-anonymity value.
             l (int): The desired l-diversity value.
             t (float): The maximum allowed t-closeness distance.
+            diversity (str): 'distinct' for distinct l-diversity or 'entropy' for entropy l-diversity.
+            n_jobs (int): The number of processes to use. With more than one, the first splits are done serially
+                and the resulting partitions are then split further in parallel, over a shared-memory copy of the
+                data. The partitions are the same as with a single process.
 
         Returns:
-            list: List of k-anonymous partitions.
+            list: List of k-anonymous partitions, each a pandas.Index of the labels of its rows.
 
         This function performs data anonymization using the Mondrian algorithm. It partitions the input dataset into
         'k'-anonymous partitions while optionally satisfying 'l'-diversity and applying 't'-closeness.
         """
-        scale = self.get_spans(self.df.index)
-        finished_partitions = []
+        permutation, finished, _ = self._partition_ranges(k, l, t, diversity, n_jobs)
+        return [self.df.index[permutation[start:end]] for _, _, start, end in finished]
+
+    def partition_ids(self, k=3, l=0, t=0.0, diversity="distinct", n_jobs=1):
+        """
+        Partition the input dataset into k-anonymous partitions, and return the partition of each row.
+
+        Parameters:
+            k (int): The desired k-anonymity value.
+            l (int): The desired l-diversity value.
+            t (float): The maximum allowed t-closeness distance.
+            diversity (str): 'distinct' for distinct l-diversity or 'entropy' for entropy l-diversity.
+            n_jobs (int): The number of processes to use.
+
+        Returns:
+            numpy.ndarray: The partition id of each row of the input DataFrame, in the order of the partitions
+            returned by partition.
+        """
+        permutation, finished, _ = self._partition_ranges(k, l, t, diversity, n_jobs)
+        return _range_ids(permutation, [(start, end) for _, _, start, end in finished])
+
+    def partition_tree(self, k=3, l=0, t=0.0, diversity="distinct", n_jobs=1, method="mean"):
+        """
+        Partition the input dataset into k-anonymous partitions, and return the splits that define them together with
+        the aggregated quasi-identifier values of each partition, so that new records can be anonymized the same way.
+
+        Parameters:
+            k (int): The desired k-anonymity value.
+            l (int): The desired l-diversity value.
+            t (float): The maximum allowed t-closeness distance.
+            diversity (str): 'distinct' for distinct l-diversity or 'entropy' for entropy l-diversity.
+            n_jobs (int): The number of processes to use.
+            method (str): How numerical quasi-identifiers are aggregated: 'mean', 'median' or 'range' (see aggregate).
+
+        Returns:
+            MondrianTree: The partition tree. Its transform method applied to the input DataFrame returns the same
+            result as aggregate.
+        """
+        permutation, finished, splits = self._partition_ranges(k, l, t, diversity, n_jobs)
+        partition_ids = _range_ids(permutation, [(start, end) for _, _, start, end in finished])
+        anonymized = aggregate(self.df, partition_ids, self.feature_columns, self.sensitive_column, method=method,
+                               verbose=False)
+        # the aggregated values of each partition, taken from its first row
+        first_rows = np.empty(len(finished), dtype=np.intp)
+        first_rows[partition_ids[::-1]] = np.arange(len(partition_ids))[::-1]
+        leaf_values = {column: anonymized[column].array[first_rows] for column in self.feature_columns
+                       if column != self.sensitive_column}
+        return MondrianTree._from_splits(self.feature_columns, self._categories(), splits, finished, leaf_values)
+
+    def _categories(self):
+        return {column: self.df[column].cat.categories for column, is_categorical
+                in zip(self.feature_columns, self.is_categorical) if is_categorical}
+
+    def sweep(self, settings, diversity="distinct", n_jobs=1):
+        """
+        Partition the input dataset for several privacy requirements at once.
+
+        The dataset is partitioned once with the smallest k and no l-diversity or t-closeness requirement, which gives
+        the finest partitions. The partitions for each requirement are then derived by merging partitions of this
+        tree bottom-up: a split is kept only if both its sides satisfy the requirement, using histograms of the
+        sensitive values accumulated from the leaves. The partitions for a requirement are valid but may differ from
+        the ones found by partitioning with it directly, which can choose other splits.
+
+        Parameters:
+            settings (list): List of (k, l, t) tuples of the privacy requirements.
+            diversity (str): 'distinct' for distinct l-diversity or 'entropy' for entropy l-diversity.
+            n_jobs (int): The number of processes to use.
+
+        Returns:
+            tuple: A pandas.DataFrame reporting the number of partitions and the information loss (see
+            information_loss) of each requirement, and a dictionary mapping each (k, l, t) tuple to the partition id
+            of each row.
+        """
+        settings = [tuple(setting) for setting in settings]
+        min_k = min(k for k, _, _ in settings)
+        permutation, finished, splits = self._partition_ranges(min_k, 0, 0.0, diversity, n_jobs)
+        tree = MondrianTree._from_splits(self.feature_columns, self._categories(), splits, finished, {})
+        leaf_ids = _range_ids(permutation, [(start, end) for _, _, start, end in finished])
+        # sizes and sensitive-value histograms of the leaves, summed up to the root
+        leaves = np.flatnonzero(tree.leaf_ids >= 0)
+        node_count = len(tree.feature)
+        sizes = np.zeros(node_count, dtype=np.intp)
+        sizes[leaves] = np.bincount(leaf_ids, minlength=len(finished))[tree.leaf_ids[leaves]]
+        hists = None
+        if self.sensitive_codes is not None:
+            n_values = len(self.global_hist)
+            hists = np.zeros((node_count, n_values), dtype=np.intp)
+            leaf_hists = np.bincount(leaf_ids * n_values + self.sensitive_codes, minlength=len(finished) * n_values)
+            hists[leaves] = leaf_hists.reshape(len(finished), n_values)[tree.leaf_ids[leaves]]
+        # children have larger ids than their parent
+        for node in np.flatnonzero(tree.feature >= 0)[::-1]:
+            sizes[node] = sizes[tree.children_left[node]] + sizes[tree.children_right[node]]
+            if hists is not None:
+                hists[node] = hists[tree.children_left[node]] + hists[tree.children_right[node]]
+        parents = np.zeros(node_count, dtype=np.intp)
+        inner = np.flatnonzero(tree.feature >= 0)
+        parents[tree.children_left[inner]] = inner
+        parents[tree.children_right[inner]] = inner
+        report = []
+        partition_ids = {}
+        for k, l, t in settings:
+            valid = self._valid_histograms(sizes, hists, k, l, t, diversity)
+            # each node belongs to the partition of its closest ancestor (or itself) that is not split anymore
+            partition_node = np.arange(node_count)
+            for node in range(1, node_count):
+                parent = parents[node]
+                if partition_node[parent] != parent or \
+                        not (valid[tree.children_left[parent]] and valid[tree.children_right[parent]]):
+                    partition_node[node] = partition_node[parent]
+            _, leaf_partitions = np.unique(partition_node[leaves], return_inverse=True)
+            ids = np.empty(len(finished), dtype=np.intp)
+            ids[tree.leaf_ids[leaves]] = leaf_partitions
+            partition_ids[(k, l, t)] = ids[leaf_ids]
+            report.append({"k": k, "l": l, "t": t, "partitions": leaf_partitions.max() + 1,
+                           "information_loss": self.information_loss(partition_ids[(k, l, t)])})
+        return pd.DataFrame(report), partition_ids
+
+    def information_loss(self, partition_ids):
+        """
+        Calculate the information loss of a partitioning, as its normalized certainty penalty: the average, over the
+        rows and the feature columns, of the range of the values of the row's partition divided by the range of the
+        values of the whole dataset. For categorical columns the range is the number of distinct values minus one.
+
+        Parameters:
+            partition_ids (numpy.ndarray): The partition id of each row.
+
+        Returns:
+            float: The information loss, between 0 (no generalization) and 1 (all rows in one partition).
+        """
+        grouped = pd.DataFrame(self.data).groupby(partition_ids)
+        ranges = np.where(self.is_categorical, grouped.nunique().to_numpy() - 1,
+                          (grouped.max() - grouped.min()).to_numpy())
+        global_ranges = np.where(self.is_categorical, [len(np.unique(values)) - 1 for values in self.data.T],
+                                 np.ptp(self.data, axis=0))
+        penalties = np.divide(ranges, global_ranges, out=np.zeros(ranges.shape), where=global_ranges > 0)
+        sizes = np.bincount(partition_ids)
+        return float((penalties.mean(axis=1) * sizes).sum() / sizes.sum())
+
+    def _valid_histograms(self, sizes, hists, k, l, t, diversity):
+        # vectorized _is_valid_histogram over the rows of hists
+        valid = sizes >= k
+        if hists is None:
+            return valid
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frequencies = hists / sizes[:, np.newaxis].astype(float)
+            if l > 0:
+                if diversity == "entropy":
+                    entropy = -np.sum(np.where(hists > 0, frequencies * np.log(frequencies), 0), axis=1)
+                    valid &= entropy >= np.log(l)
+                else:
+                    valid &= np.count_nonzero(hists, axis=1) >= l
+            if t > 0.0:
+                distances = np.where(hists > 0, np.abs(frequencies - self.global_freqs), 0)
+                valid &= distances.max(axis=1) <= t
+        return valid
+
+    def _partition_ranges(self, k, l, t, diversity, n_jobs=1):
+        # returns a permutation of the row positions, the (depth, path, start, end) of each finished partition and
+        # the (depth, path, column, rule) of each split. rows keep their original relative order within each
+        # partition.
+        if diversity not in ("distinct", "entropy"):
+            raise ValueError("diversity should be either 'distinct' or 'entropy'")
+        scale = self._block_spans(self.data)
+        permutation = np.arange(len(self.df))
         # the algorithm start with the entire dataset as one partition and will iteratively split it into smaller parts
-        partitions = [self.df.index]
-        while partitions:
-            partition = partitions.pop(0)
-            spans = self.get_spans(partition, scale)
-            for column, span in sorted(spans.items(), key=lambda x: -x[1]):
-                lp, rp = self.split(column, partition)
+        partitions = deque([(0, len(self.df), self._sensitive_histogram(permutation), 0, 0)])
+        seed = self.random_state if self.random_state is not None else np.random.SeedSequence().entropy
+        criteria = (scale, k, l, t, diversity, self.median_sample_size, seed)
+        splits = []
+        if n_jobs > 1:
+            # split serially until there are enough partitions to keep all the processes busy
+            finished = self._split_partitions(permutation, partitions, criteria, splits, max_partitions=4 * n_jobs)
+            if partitions:
+                finished.extend(self._split_partitions_parallel(permutation, partitions, criteria, splits, n_jobs))
+            # serial splitting finishes partitions in breadth-first order, i.e., by depth and then from left to right
+            finished.sort(key=lambda partition: partition[:2])
+        else:
+            finished = self._split_partitions(permutation, partitions, criteria, splits)
+        return permutation, finished, splits
+
+    def _split_partitions_parallel(self, permutation, partitions, criteria, splits, n_jobs):
+        arrays = {"data": self.data, "permutation": permutation}
+        if self.sensitive_codes is not None:
+            arrays["sensitive_codes"] = self.sensitive_codes
+        shared = {}
+        try:
+            for name, array in arrays.items():
+                shared[name] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, array.dtype, buffer=shared[name].buf)[...] = array
+            specs = {name: (shared[name].name, array.shape, array.dtype.str) for name, array in arrays.items()}
+            global_hist = self.global_hist if self.sensitive_codes is not None else None
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                futures = [executor.submit(_split_shared_partition, specs, self.is_categorical, global_hist, partition,
+                                           criteria) for partition in partitions]
+                finished = []
+                for future in futures:
+                    subtree_finished, subtree_splits = future.result()
+                    finished.extend(subtree_finished)
+                    splits.extend(subtree_splits)
+            # each process reordered the rows of its own partitions only
+            permutation[...] = np.ndarray(permutation.shape, permutation.dtype, buffer=shared["permutation"].buf)
+        finally:
+            for memory in shared.values():
+                memory.close()
+                memory.unlink()
+        return finished
+
+    def _split_partitions(self, permutation, partitions, criteria, splits, max_partitions=None):
+        # splits the partitions of the work list until they cannot be split anymore, or until the work list holds
+        # max_partitions partitions. returns the (depth, path, start, end) of each finished partition, where path
+        # encodes the left (0) and right (1) turns from the root, and adds the (depth, path, column, rule) of each
+        # split to splits.
+        scale, k, l, t, diversity, median_sample_size, seed = criteria
+        finished_ranges = []
+        while partitions and (max_partitions is None or len(partitions) < max_partitions):
+            start, end, hist, depth, path = partitions.popleft()
+            rows = permutation[start:end]
+            split = self._find_split(rows, hist, criteria, (seed, start, end))
+            if split is None:
+                finished_ranges.append((depth, path, start, end))
+                continue
+            lp, rp, lh, rh, column, rule = split
+            splits.append((depth, path, column, rule))
+            permutation[start:end] = np.concatenate((lp, rp))
+            middle = start + len(lp)
+            partitions.append((start, middle, lh, depth + 1, 2 * path))
+            partitions.append((middle, end, rh, depth + 1, 2 * path + 1))
+        return finished_ranges
+
+    def _find_split(self, rows, hist, criteria, seed):
+        # returns the left and right partitions, their histograms and the column and rule of the split, or None if
+        # the partition cannot be split
+        scale, k, l, t, diversity, median_sample_size, _ = criteria
+        block = self.data[rows]
+        spans = self._block_spans(block, scale)
+        for i in np.argsort(-spans, kind="stable"):
+            for rule in self._candidate_split_rules(block[:, i], self.is_categorical[i], median_sample_size,
+                                                    seed + (i,)):
+                go_left = _split_mask(block[:, i], rule, self.is_categorical[i])
+                lp, rp = rows[go_left], rows[~go_left]
+                # the histogram of the right partition is the difference between its parent's and the left partition's
+                lh = self._sensitive_histogram(lp)
+                rh = hist - lh if hist is not None else None
                 # checks in the left partition or the right partition satisfy the criteria
-                if not self.is_valid(lp, k, l, t) or not self.is_valid(rp, k, l, t):
-                    continue
-                partitions.extend((lp, rp))
-                break
+                if self._is_valid_histogram(len(lp), lh, k, l, t, diversity) and \
+                        self._is_valid_histogram(len(rp), rh, k, l, t, diversity):
+                    return lp, rp, lh, rh, i, rule
+        return None
+
+    @classmethod
+    def _from_arrays(cls, data, is_categorical, sensitive_codes=None, global_hist=None):
+        # a Mondrian instance without the DataFrame, that can only split partitions
+        mondrian = cls.__new__(cls)
+        mondrian.data = data
+        mondrian.is_categorical = is_categorical
+        mondrian.sensitive_codes = sensitive_codes
+        if sensitive_codes is not None:
+            mondrian.global_hist = global_hist
+            mondrian.global_freqs = global_hist / float(len(sensitive_codes))
+        return mondrian
+
+
+class MondrianTree:
+    """
+    The splits found by the Mondrian algorithm, as a binary tree whose leaves are the partitions, together with the
+    aggregated quasi-identifier values of each partition. It is used to anonymize new records consistently with an
+    already anonymized dataset, without partitioning it again.
+
+    Rows go to the left child of a node if their value of the node's column is lower than the node's threshold
+    (numerical columns), or if it is one of the node's left categories (categorical columns). Categories that were not
+    seen when partitioning go to the right child.
+    """
+
+    def __init__(self, feature_columns, categories, feature, threshold, left_categories, children_left,
+                 children_right, leaf_ids, leaf_values):
+        """
+        Initialize the MondrianTree instance.
+
+        Parameters:
+            feature_columns (list): A list of column names containing the feature attributes.
+            categories (dict): The categories of each categorical feature column.
+            feature (numpy.ndarray): The index of the feature column each node splits on (-1 for leaves).
+            threshold (numpy.ndarray): The threshold of each node splitting on a numerical column.
+            left_categories (numpy.ndarray): Whether each category code goes to the left child of each node splitting
+                on a categorical column, shape (node_count, max number of categories).
+            children_left (numpy.ndarray): The left child of each node (-1 for leaves).
+            children_right (numpy.ndarray): The right child of each node (-1 for leaves).
+            leaf_ids (numpy.ndarray): The partition id of each leaf (-1 for inner nodes).
+            leaf_values (dict): The aggregated values of each partition, for each quasi-identifier column.
+        """
+        self.feature_columns = feature_columns
+        self.categories = categories
+        self.feature = feature
+        self.threshold = threshold
+        self.left_categories = left_categories
+        self.children_left = children_left
+        self.children_right = children_right
+        self.leaf_ids = leaf_ids
+        self.leaf_values = leaf_values
+
+    @classmethod
+    def _from_splits(cls, feature_columns, categories, splits, finished, leaf_values):
+        # nodes are numbered in breadth-first order, so that leaves are numbered in the order of their partition ids
+        keys = sorted([(depth, path) for depth, path, _, _ in splits] +
+                      [(depth, path) for depth, path, _, _ in finished])
+        node_ids = {key: node for node, key in enumerate(keys)}
+        node_count = len(keys)
+        feature = np.full(node_count, -1, dtype=np.intp)
+        threshold = np.full(node_count, np.nan)
+        max_categories = max([len(values) for values in categories.values()], default=0)
+        left_categories = np.zeros((node_count, max_categories), dtype=bool)
+        children_left = np.full(node_count, -1, dtype=np.intp)
+        children_right = np.full(node_count, -1, dtype=np.intp)
+        for depth, path, column, rule in splits:
+            node = node_ids[(depth, path)]
+            feature[node] = column
+            if feature_columns[column] in categories:
+                left_categories[node, np.asarray(rule, dtype=np.intp)] = True
+            else:
+                threshold[node] = rule
+            children_left[node] = node_ids[(depth + 1, 2 * path)]
+            children_right[node] = node_ids[(depth + 1, 2 * path + 1)]
+        leaf_ids = np.full(node_count, -1, dtype=np.intp)
+        leaf_ids[[node_ids[(depth, path)] for depth, path, _, _ in finished]] = np.arange(len(finished))
+        return cls(feature_columns, categories, feature, threshold, left_categories, children_left, children_right,
+                   leaf_ids, leaf_values)
+
+    def apply(self, df):
+        """
+        Find the partition of each row.
+
+        Parameters:
+            df (pandas.DataFrame): The DataFrame, containing the feature columns.
+
+        Returns:
+            numpy.ndarray: The partition id of each row.
+        """
+        data = np.empty((len(df), len(self.feature_columns)), dtype=np.float64)
+        is_categorical = np.zeros(len(self.feature_columns), dtype=bool)
+        for i, column in enumerate(self.feature_columns):
+            if column in self.categories:
+                is_categorical[i] = True
+                data[:, i] = pd.Categorical(df[column], categories=self.categories[column]).codes
             else:
-                finished_partitions.append(partition)
-        return finished_partitions
+                data[:, i] = df[column]
+        node_ids = np.zeros(len(df), dtype=np.intp)
+        active = np.arange(len(df)) if self.feature[0] >= 0 else np.empty(0, dtype=np.intp)
+        # move all rows one level down at a time, until they all reach a leaf
+        while active.size:
+            nodes = node_ids[active]
+            features = self.feature[nodes]
+            values = data[active, features]
+            go_left = values < self.threshold[nodes]
+            categorical = is_categorical[features]
+            if categorical.any():
+                codes = values[categorical].astype(np.intp)
+                known = codes >= 0
+                go_left[categorical] = known & self.left_categories[nodes[categorical], np.where(known, codes, 0)]
+            node_ids[active] = np.where(go_left, self.children_left[nodes], self.children_right[nodes])
+            active = active[self.feature[node_ids[active]] >= 0]
+        return self.leaf_ids[node_ids]
+
+    def transform(self, df):
+        """
+        Anonymize records by replacing their quasi-identifier values with the aggregated values of their partition.
+
+        Parameters:
+            df (pandas.DataFrame): The DataFrame to anonymize, containing the feature columns.
+
+        Returns:
+            pandas.DataFrame: Anonymized DataFrame with aggregated quasi-identifier values.
+        """
+        partition_ids = self.apply(df)
+        newdf = df.copy()
+        for column, values in self.leaf_values.items():
+            newdf[column] = values[partition_ids]
+        return newdf
+
+    def save(self, path):
+        """
+        Save the partition tree to a file in NumPy .npz format.
+
+        Parameters:
+            path (str): The path of the file.
+        """
+        metadata = {"feature_columns": list(self.feature_columns),
+                    "categories": {column: values.tolist() for column, values in self.categories.items()},
+                    "aggregated_columns": list(self.leaf_values.keys())}
+        arrays = {}
+        for i, values in enumerate(self.leaf_values.values()):
+            # categorical values are stored as their codes, other values as numbers or strings
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                arrays["leaf_values_%d" % i] = values.codes
+            else:
+                values = np.asarray(values)
+                arrays["leaf_values_%d" % i] = values.astype(str) if values.dtype == object else values
+        np.savez_compressed(path, metadata=np.array(json.dumps(metadata)), feature=self.feature,
+                            threshold=self.threshold, left_categories=self.left_categories,
+                            children_left=self.children_left, children_right=self.children_right,
+                            leaf_ids=self.leaf_ids, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a partition tree saved with save.
+
+        Parameters:
+            path (str): The path of the file.
+
+        Returns:
+            MondrianTree: The partition tree.
+        """
+        with np.load(path) as arrays:
+            metadata = json.loads(str(arrays["metadata"]))
+            categories = {column: pd.Index(values) for column, values in metadata["categories"].items()}
+            leaf_values = {}
+            for i, column in enumerate(metadata["aggregated_columns"]):
+                values = arrays["leaf_values_%d" % i]
+                if column in categories:
+                    values = pd.Categorical.from_codes(values, categories=categories[column])
+                leaf_values[column] = values
+            return cls(metadata["feature_columns"], categories, arrays["feature"], arrays["threshold"],
+                       arrays["left_categories"], arrays["children_left"], arrays["children_right"],
+                       arrays["leaf_ids"], leaf_values)
+
+
+def _split_mask(values, rule, is_categorical):
+    # returns which rows of the partition go to the left partition
+    if is_categorical:
+        return np.isin(values, rule)
+    return values < rule
+
+
+def _median(values):
+    # same as pandas.Series.median, without sorting all the values
+    n = len(values)
+    middle = np.partition(values, [(n - 1) // 2, n // 2])
+    return (middle[(n - 1) // 2] + middle[n // 2]) / 2
+
+
+def _range_ids(permutation, ranges):
+    # returns the number of the range that each row (value of the permutation) falls into
+    starts = np.array([start for start, _ in ranges], dtype=np.intp)
+    lengths = np.array([end - start for start, end in ranges], dtype=np.intp)
+    order = np.argsort(starts)
+    ids = np.empty(len(permutation), dtype=np.intp)
+    ids[permutation] = np.repeat(order, lengths[order])
+    return ids
+
+
+def _split_shared_partition(specs, is_categorical, global_hist, partition, criteria):
+    """
+    Split a partition of the data in shared memory until it cannot be split anymore, in a worker process.
+
+    Parameters:
+        specs (dict): The name, shape and dtype of the shared memory block of each array.
+        is_categorical (numpy.ndarray): Whether each feature column is categorical.
+        global_hist (numpy.ndarray): The number of rows with each sensitive value in the whole dataset.
+        partition (tuple): The (start, end, hist, depth, path) of the partition to split.
+        criteria (tuple): The scale of the feature columns, k, l, t, diversity, median_sample_size and the seed.
+
+    Returns:
+        tuple: The (depth, path, start, end) of each finished partition and the (depth, path, column, rule) of each
+        split.
+    """
+    shared = {name: shared_memory.SharedMemory(name=spec[0]) for name, spec in specs.items()}
+    arrays = {name: np.ndarray(spec[1], spec[2], buffer=shared[name].buf) for name, spec in specs.items()}
+    mondrian = None
+    try:
+        mondrian = Mondrian._from_arrays(arrays["data"], is_categorical, arrays.get("sensitive_codes"), global_hist)
+        splits = []
+        finished = mondrian._split_partitions(arrays["permutation"], deque([partition]), criteria, splits)
+        return finished, splits
+    finally:
+        # the arrays must not reference the shared memory anymore when it is closed
+        arrays = mondrian = None
+        for memory in shared.values():
+            memory.close()
 
 
 def is_k_anonymous(partition, k):
@@ -193,6 +737,36 @@ def is_t_close(df, partition, sensitive_column, global_freqs, t):
             d_max = d
     return d_max <= t
 
+def is_entropy_l_diverse_histogram(hist, l):
+    """
+    Check if a partition satisfies entropy l-diversity, i.e., if the entropy of its sensitive values is at least log(l).
+
+    Parameters:
+        hist (numpy.ndarray): The number of rows of the partition with each sensitive value.
+        l (int): The desired l-diversity value.
+
+    Returns:
+        bool: True if the partition satisfies entropy l-diversity, False otherwise.
+    """
+    p = hist[hist > 0] / float(hist.sum())
+    return -np.sum(p * np.log(p)) >= np.log(l)
+
+def is_t_close_histogram(hist, global_freqs, t):
+    """
+    Check if a partition satisfies t-closeness, using the histogram of its sensitive values.
+
+    Parameters:
+        hist (numpy.ndarray): The number of rows of the partition with each sensitive value.
+        global_freqs (numpy.ndarray): Global frequency of each sensitive value, in the same order as hist.
+        t (float): The maximum allowed t-closeness distance.
+
+    Returns:
+        bool: True if the maximum distance is less than t threshold, False otherwise.
+    """
+    present = hist > 0
+    d_max = np.abs(hist[present] / float(hist.sum()) - global_freqs[present]).max()
+    return d_max <= t
+
 def get_global_freq(df, sensitive_column):
     """
     Calculate the global frequency distribution of sensitive values.
@@ -219,21 +793,26 @@ def showcase(df, n, partitions):
     Parameters:
         df (pandas.DataFrame): The input DataFrame to print partitions from.
         n (int): The number of random partitions to showcase.
-        partitions (list of pandas.Index or int): The list of partition indices.
+        partitions (list of pandas.Index or int, or numpy.ndarray): The list of partition indices, or the partition id
+            of each row.
 
     This function selects n random partitions and prints them using the tabulate library.
     """
     print("Showcasing some of the anonymized partition:")
+    is_ids = isinstance(partitions, np.ndarray)
+    n_partitions = partitions.max() + 1 if is_ids else len(partitions)
     randomlist = []
     for i in range(0, n):
-        rand = random.randint(0, len(partitions) - 1)
+        rand = random.randint(0, n_partitions - 1)
         randomlist.append(rand)
     for x in randomlist:
         print("Partition", x)
-        print(tabulate(df.iloc[partitions[x]], headers='keys', tablefmt='psql'))
+        rows = np.flatnonzero(partitions == x) if is_ids else partitions[x]
+        print(tabulate(df.iloc[rows], headers='keys', tablefmt='psql'))
 
 
-def __anonymize(df, feature_columns, sensitive_column, k, l=0, t=0.0):
+def __anonymize(df, feature_columns, sensitive_column, k, l=0, t=0.0, diversity="distinct", method="mean",
+                verbose=True):
     """
     Anonymize a dataset using the Mondrian algorithm.
 
@@ -244,6 +823,9 @@ def __anonymize(df, feature_columns, sensitive_column, k, l=0, t=0.0):
         k (int): The desired k-anonymity value.
         l (int): The desired l-diversity value (default is 0, indicating no l-diversity requirement).
         t (float): The maximum allowed t-closeness distance (default is 0.0, indicating no t-closeness requirement).
+        diversity (str): 'distinct' for distinct l-diversity or 'entropy' for entropy l-diversity.
+        method (str): How numerical quasi-identifiers are aggregated: 'mean', 'median' or 'range' (see aggregate).
+        verbose (bool): Whether to print the progress and showcase some of the partitions.
 
     Returns:
         pandas.DataFrame: Anonymized version of the input DataFrame.
@@ -254,15 +836,17 @@ def __anonymize(df, feature_columns, sensitive_column, k, l=0, t=0.0):
     The anonymization process involves partitioning and aggregation of data to ensure that each
     partition satisfies the specified privacy requirements.
     """
-    print("=========Start anonymization process:")
-    print("Partition the dataset:")
+    if verbose:
+        print("=========Start anonymization process:")
+        print("Partition the dataset:")
     mondrian = Mondrian(df, feature_columns, sensitive_column)
-    partitions = mondrian.partition(k, l, t)
-    print(len(partitions), "partitions created.")
-    return aggregate(df, partitions, feature_columns, sensitive_column)
+    partition_ids = mondrian.partition_ids(k, l, t, diversity)
+    if verbose:
+        print(partition_ids.max() + 1, "partitions created.")
+    return aggregate(df, partition_ids, feature_columns, sensitive_column, method=method, verbose=verbose)
 
 
-def anonymize_k_anonymity(df, feature_columns, sensitive_column, k):
+def anonymize_k_anonymity(df, feature_columns, sensitive_column, k, method="mean", verbose=True):
     """
     A wrapper function passing k-anonymity parameters to the anonymize function
 
@@ -271,14 +855,17 @@ def anonymize_k_anonymity(df, feature_columns, sensitive_column, k):
         feature_columns (list): List of column names to be used as quasi-identifiers for k-anonymity.
         sensitive_column (str): The column name containing sensitive information.
         k (int): The desired k-value for k-anonymity.
+        method (str): How numerical quasi-identifiers are aggregated: 'mean', 'median' or 'range' (see aggregate).
+        verbose (bool): Whether to print the progress and showcase some of the partitions.
 
     Returns:
         pandas.DataFrame: A new DataFrame with k-anonymized data.
     """
-    return __anonymize(df, feature_columns, sensitive_column, k)
+    return __anonymize(df, feature_columns, sensitive_column, k, method=method, verbose=verbose)
 
 
-def anonymize_l_diversity(df, feature_columns, sensitive_column, k, l):
+def anonymize_l_diversity(df, feature_columns, sensitive_column, k, l, diversity="distinct", method="mean",
+                          verbose=True):
     """
     A wrapper function passing l-diversity parameters to the anonymize function
 
@@ -288,14 +875,19 @@ def anonymize_l_diversity(df, feature_columns, sensitive_column, k, l):
         sensitive_column (str): The column name containing sensitive information.
         k (int): The desired k-value for k-anonymity.
         l (int): The desired l-value for l-diversity.
+        diversity (str): 'distinct' for distinct l-diversity (at least l distinct sensitive values in each partition)
+            or 'entropy' for entropy l-diversity (entropy of the sensitive values of each partition at least log(l)).
+        method (str): How numerical quasi-identifiers are aggregated: 'mean', 'median' or 'range' (see aggregate).
+        verbose (bool): Whether to print the progress and showcase some of the partitions.
 
     Returns:
         pandas.DataFrame: A new DataFrame with k-anonymized and l-diverse data.
     """
-    return __anonymize(df, feature_columns, sensitive_column, k, l=l)
+    return __anonymize(df, feature_columns, sensitive_column, k, l=l, diversity=diversity, method=method,
+                       verbose=verbose)
 
 
-def anonymize_t_closeness(df, feature_columns, sensitive_column, k, t):
+def anonymize_t_closeness(df, feature_columns, sensitive_column, k, t, method="mean", verbose=True):
     """
     A wrapper function passing t-closeness parameters to the anonymize function
 
@@ -305,33 +897,80 @@ def anonymize_t_closeness(df, feature_columns, sensitive_column, k, t):
         sensitive_column (str): The column name containing sensitive information.
         k (int): The desired k-value for k-anonymity.
         t (float): The desired t-closeness value.
+        method (str): How numerical quasi-identifiers are aggregated: 'mean', 'median' or 'range' (see aggregate).
+        verbose (bool): Whether to print the progress and showcase some of the partitions.
 
     Returns:
         pandas.DataFrame: A new DataFrame with k-anonymized and t-close data.
     """
-    return __anonymize(df, feature_columns, sensitive_column, k, t=t)
+    return __anonymize(df, feature_columns, sensitive_column, k, t=t, method=method, verbose=verbose)
 
 
-def aggregate(df, partitions, feature_columns, sensitive_column, max_partitions=None):
+def aggregate(df, partitions, feature_columns, sensitive_column, max_partitions=None, method="mean",
+              verbose=True):
     """
     Aggregate quasi-identifier values within partitions.
 
     Parameters:
         df (pandas.DataFrame): The input DataFrame.
-        partitions (list): List of partitions to aggregate.
+        partitions (list or numpy.ndarray): List of partitions to aggregate, or the partition id of each row (as
+            returned by Mondrian.partition_ids).
         feature_columns (list): List of column names representing the feature attributes.
         sensitive_column (str): The name of the column containing sensitive information.
         max_partitions (int, optional): Maximum number of partitions to process (default is None).
+        method (str): How numerical columns are aggregated: 'mean', 'median' or 'range' (the string 'min-max' of the
+            values of the partition, or the value itself if they are all equal). Categorical columns are replaced
+            with their most frequent value in the partition.
+        verbose (bool): Whether to print the progress and showcase some of the partitions.
 
     Returns:
         pandas.DataFrame: Anonymized DataFrame with aggregated quasi-identifier values.
     """
-    print("Changing quasi-identifiers values with the aggregation of their partition")
+    if method not in ("mean", "median", "range"):
+        raise ValueError("method should be one of 'mean', 'median' or 'range'")
+    if verbose:
+        print("Changing quasi-identifiers values with the aggregation of their partition")
+    if isinstance(partitions, np.ndarray):
+        partition_ids = partitions
+    else:
+        partition_ids = _partition_ids(df, partitions)
+    n_partitions = partition_ids.max() + 1
     newdf = df.copy()
-    for partition in partitions:
-        for column in feature_columns:
-            if column != sensitive_column:
-                newdf.loc[partition, column] = newdf.loc[partition, column].mean()
-    showcase(newdf, 3, partitions)
-    print("Anonymized dataset generated")
-    return newdf
\ No newline at end of file
+    for column in feature_columns:
+        if column == sensitive_column:
+            continue
+        values = df[column]
+        if values.dtype.name == "category":
+            # most frequent category of each partition (the first one on ties). missing values (code -1) are not
+            # counted, partitions with only missing values stay missing
+            n_categories = len(values.cat.categories)
+            codes = values.cat.codes.to_numpy()
+            present = codes >= 0
+            counts = np.bincount(partition_ids[present] * n_categories + codes[present],
+                                 minlength=n_partitions * n_categories).reshape(n_partitions, n_categories)
+            codes = np.where(counts.any(axis=1), counts.argmax(axis=1), -1)
+            newdf[column] = pd.Categorical.from_codes(codes[partition_ids], dtype=values.dtype)
+            continue
+        grouped = values.groupby(partition_ids)
+        if method == "range":
+            low = grouped.min().astype(str).to_numpy(dtype=object)
+            high = grouped.max().astype(str).to_numpy(dtype=object)
+            aggregated = np.where(low == high, low, low + "-" + high)
+        else:
+            aggregated = getattr(grouped, method)().to_numpy()
+        newdf[column] = aggregated[partition_ids]
+    if verbose:
+        showcase(newdf, 3, partition_ids)
+        print("Anonymized dataset generated")
+    return newdf
+
+
+def _partition_ids(df, partitions):
+    # converts a list of partitions (indexes of labels) to the partition id of each row
+    labels = np.concatenate([np.asarray(partition) for partition in partitions])
+    partition_ids = np.full(len(df), -1, dtype=np.intp)
+    partition_ids[df.index.get_indexer(labels)] = np.repeat(np.arange(len(partitions)),
+                                                             [len(partition) for partition in partitions])
+    if (partition_ids < 0).any():
+        raise ValueError("partitions should cover all the rows of df")
+    return partition_ids
@@ -1,7 +1,10 @@
 """
 This module contains functions to measure several privacy metrics such as k-anonymity and l-diversity
 """
+import numpy as np
 import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 def satisfies_k_anonymity(df, k, qi_columns):
     """
@@ -33,8 +36,8 @@ def find_k_anonymity(df, qi_columns):
     """
     Find the maximum k value for which k-anonymity is satisfied in the entire dataset.
 
-    This function iteratively increases the value k until the dataset no longer satisfies k-anonymity.
-    It uses the 'satisfies_k_anonymity' function to check if the dataset satisfies k-anonymity or not.
+    The maximum k is the size of the smallest equivalence class, which is found by 'privacy_report' in a single
+    pass over the dataset.
 
     Parameters:
         df (pandas.DataFrame): The input DataFrame containing sensitive and quasi-identifier data.
@@ -43,11 +46,9 @@ def find_k_anonymity(df, qi_columns):
     Returns:
         int: The maximum k for which the dataset still satisfies k-anonymity.
     """
-    k = 1
-    while satisfies_k_anonymity(df, k, qi_columns):
-        k += 1
-    print(f"Dataset satisfies maximum {k-1}-anonymity")
-    return k - 1
+    k = privacy_report(df, qi_columns, verbose=False)['k']
+    print(f"Dataset satisfies maximum {k}-anonymity")
+    return k
 
 def satisfies_l_diversity(df, l, qi_columns, sensitive_column):
     """
@@ -84,8 +85,8 @@ def find_l_diversity(df, qi_columns, sensitive_column):
     """
     Find the maximum l value for which l-diversity is satisfied in the entire dataset.
 
-    This function iteratively increases the value 'l' until the dataset no longer satisfies l-diversity.
-    It uses the 'satisfies_l_diversity' function to check if the dataset satisfies l-diversity or not.
+    The maximum 'l' is the minimum number of distinct sensitive values in an equivalence class, which is found by
+    'privacy_report' in a single pass over the dataset.
 
     Parameters:
         df (pandas.DataFrame): The input DataFrame containing sensitive and quasi-identifier data.
@@ -95,8 +96,191 @@ def find_l_diversity(df, qi_columns, sensitive_column):
     Returns:
         int: The maximum 'l' for which the dataset still satisfies l-diversity.
     """
-    l = 1
-    while satisfies_l_diversity(df, l, qi_columns, sensitive_column):
-        l += 1
-    print(f"Dataset satisfies maximum {l-1}-diversity")
-    return l - 1
+    l = privacy_report(df, qi_columns, sensitive_column, verbose=False)['l_distinct']
+    print(f"Dataset satisfies maximum {l}-diversity")
+    return l
+
+def privacy_report(df, qi_columns, sensitive_column=None, c=None, verbose=True):
+    """
+    Measure k-anonymity, l-diversity and t-closeness of a dataset in a single pass over it.
+
+    This function assigns each row to its equivalence class (the rows with the same quasi-identifier values) once,
+    and computes all the metrics from the class sizes and the counts of the sensitive values in each class, instead
+    of grouping the DataFrame again for each metric and each candidate value.
+
+    Parameters:
+        df (pandas.DataFrame): The input DataFrame containing sensitive and quasi-identifier data.
+        qi_columns (list): A list of column names representing the quasi-identifier attributes.
+        sensitive_column (str, optional): The name of the column containing sensitive information. If None, only
+            k-anonymity is measured.
+        c (float, optional): The constant of recursive (c, l)-diversity. If None, recursive (c, l)-diversity is not
+            measured.
+        verbose (bool): Whether to print the metrics.
+
+    Returns:
+        dict: The metrics of the dataset:
+            'k': the size of the smallest equivalence class, i.e., the maximum k for which k-anonymity is satisfied.
+            'class_sizes': a pandas.Series mapping each equivalence class size to the number of classes of that size.
+            'l_distinct': the minimum number of distinct sensitive values in an equivalence class.
+            'l_entropy': the minimum exponent of the entropy of the sensitive values of an equivalence class, i.e.,
+                the maximum l for which entropy l-diversity is satisfied.
+            'l_recursive': the maximum l for which recursive (c, l)-diversity is satisfied (only if c is given).
+            't': the maximum distance between the frequency of a sensitive value in an equivalence class and in the
+                whole dataset, over the values present in the class, i.e., the minimum t for which t-closeness is
+                satisfied.
+    """
+    class_ids = df.groupby(qi_columns, sort=False, dropna=False).ngroup().to_numpy()
+    pairs = None
+    if sensitive_column is not None:
+        codes, values = pd.factorize(df[sensitive_column], use_na_sentinel=False)
+        # one entry per (equivalence class, sensitive value) pair present in the data, sorted by class
+        pairs, counts = np.unique(class_ids * len(values) + codes, return_counts=True)
+        pairs = np.divmod(pairs, len(values)) + (counts,)
+    return _report(np.bincount(class_ids), pairs, c, verbose)
+
+def privacy_report_file(path, qi_columns, sensitive_column=None, c=None, chunk_size=1000000, n_jobs=1, verbose=True):
+    """
+    Measure k-anonymity, l-diversity and t-closeness of a dataset stored in a file too large to fit in memory.
+
+    The file is read in chunks. The quasi-identifier values of each row are hashed to a 64-bit key, and each chunk is
+    reduced to the number of rows of each (key, sensitive value) pair, in a pool of processes. Only these counts are
+    merged, so the memory used is proportional to the number of equivalence classes rather than to the number of
+    rows. The metrics are the same as the ones of privacy_report (up to 64-bit hash collisions, which are very
+    unlikely), except that values are compared as read from the file.
+
+    Parameters:
+        path (str): The path of the input file, either CSV or Parquet (.parquet, requires pyarrow).
+        qi_columns (list): A list of column names representing the quasi-identifier attributes.
+        sensitive_column (str, optional): The name of the column containing sensitive information. If None, only
+            k-anonymity is measured.
+        c (float, optional): The constant of recursive (c, l)-diversity. If None, recursive (c, l)-diversity is not
+            measured.
+        chunk_size (int): The number of rows read at a time.
+        n_jobs (int): The number of processes counting the chunks.
+        verbose (bool): Whether to print the metrics.
+
+    Returns:
+        dict: The metrics of the dataset, see privacy_report.
+    """
+    columns = list(qi_columns) + ([sensitive_column] if sensitive_column is not None else [])
+    if path.endswith(".parquet"):
+        chunks = _read_parquet_chunks(path, columns, chunk_size)
+    else:
+        # values are kept as read, so that their type does not depend on the other values of the chunk
+        chunks = pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunk_size)
+    counts = None
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_count_pairs, chunk, qi_columns, sensitive_column))
+                # bounds the number of chunks in memory
+                if len(pending) >= 2 * n_jobs:
+                    counts = _merge_counts(counts, pending.popleft().result())
+            while pending:
+                counts = _merge_counts(counts, pending.popleft().result())
+    else:
+        for chunk in chunks:
+            counts = _merge_counts(counts, _count_pairs(chunk, qi_columns, sensitive_column))
+    class_ids = pd.factorize(counts.index.get_level_values(0))[0]
+    pairs = None
+    if sensitive_column is not None:
+        value_ids = pd.factorize(counts.index.get_level_values(1), use_na_sentinel=False)[0]
+        order = np.argsort(class_ids, kind="stable")
+        pairs = (class_ids[order], value_ids[order], counts.to_numpy()[order])
+    sizes = np.bincount(class_ids, weights=counts.to_numpy()).astype(np.int64)
+    return _report(sizes, pairs, c, verbose)
+
+def _read_parquet_chunks(path, columns, chunk_size):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas()
+
+def _count_pairs(chunk, qi_columns, sensitive_column):
+    """
+    Count the rows of each (equivalence class key, sensitive value) pair of a chunk.
+
+    Parameters:
+        chunk (pandas.DataFrame): The chunk.
+        qi_columns (list): A list of column names representing the quasi-identifier attributes.
+        sensitive_column (str): The name of the column containing sensitive information, or None.
+
+    Returns:
+        pandas.Series: The number of rows of each pair, indexed by the 64-bit key of the quasi-identifier values and
+        the sensitive value (only by the key if sensitive_column is None).
+    """
+    keys = pd.util.hash_pandas_object(chunk[qi_columns], index=False).to_numpy()
+    if sensitive_column is None:
+        return pd.Series(keys).value_counts()
+    return pd.DataFrame({"key": keys, "value": chunk[sensitive_column].to_numpy()}).value_counts(dropna=False)
+
+def _merge_counts(counts, chunk_counts):
+    if counts is None:
+        return chunk_counts
+    merged = pd.concat([counts, chunk_counts])
+    return merged.groupby(level=list(range(merged.index.nlevels)), dropna=False).sum()
+
+def _report(sizes, pairs, c, verbose):
+    """
+    Calculate the metrics of privacy_report.
+
+    Parameters:
+        sizes (numpy.ndarray): The size of each equivalence class.
+        pairs (tuple): The equivalence class, sensitive value code and number of rows of each (class, sensitive
+            value) pair, sorted by class, or None if there is no sensitive column.
+        c (float): The constant of recursive (c, l)-diversity, or None.
+        verbose (bool): Whether to print the metrics.
+
+    Returns:
+        dict: The metrics of the dataset, see privacy_report.
+    """
+    report = {"k": int(sizes.min()), "class_sizes": pd.Series(sizes).value_counts().sort_index()}
+    if pairs is not None:
+        pair_classes, pair_values, counts = pairs
+        global_freqs = np.bincount(pair_values, weights=counts) / float(sizes.sum())
+        frequencies = counts / sizes[pair_classes].astype(float)
+        report["l_distinct"] = int(np.bincount(pair_classes).min())
+        entropy = -np.bincount(pair_classes, weights=frequencies * np.log(frequencies))
+        report["l_entropy"] = float(np.exp(entropy.min()))
+        if c is not None:
+            report["l_recursive"] = _recursive_l(pair_classes, counts, c)
+        class_starts = np.flatnonzero(np.r_[True, pair_classes[1:] != pair_classes[:-1]])
+        distances = np.abs(frequencies - global_freqs[pair_values])
+        report["t"] = float(np.maximum.reduceat(distances, class_starts).max())
+    if verbose:
+        print(f"Dataset satisfies maximum {report['k']}-anonymity")
+        if pairs is not None:
+            print(f"Dataset satisfies maximum {report['l_distinct']}-diversity")
+            print(f"Dataset satisfies maximum {report['l_entropy']:.4f} entropy l-diversity")
+            if c is not None:
+                print(f"Dataset satisfies maximum recursive ({c}, {report['l_recursive']})-diversity")
+            print(f"Dataset satisfies minimum {report['t']:.4f}-closeness")
+    return report
+
+def _recursive_l(pair_classes, counts, c):
+    """
+    Find the maximum l for which recursive (c, l)-diversity is satisfied.
+
+    An equivalence class satisfies recursive (c, l)-diversity if r1 < c * (rl + ... + rm), where r1 >= ... >= rm are
+    the counts of its sensitive values.
+
+    Parameters:
+        pair_classes (numpy.ndarray): The equivalence class of each (class, sensitive value) pair, sorted.
+        counts (numpy.ndarray): The number of rows of each pair.
+        c (float): The constant of recursive (c, l)-diversity.
+
+    Returns:
+        int: The maximum l satisfied by all the equivalence classes (0 if none).
+    """
+    # counts of each class in decreasing order
+    order = np.lexsort((-counts, pair_classes))
+    pair_classes, counts = pair_classes[order], counts[order]
+    class_starts = np.flatnonzero(np.r_[True, pair_classes[1:] != pair_classes[:-1]])
+    class_totals = np.add.reduceat(counts, class_starts)
+    class_offsets = np.cumsum(class_totals) - class_totals
+    # sum of the counts from each position to the end of its class
+    suffix_sums = class_totals[pair_classes] - (np.cumsum(counts) - counts - class_offsets[pair_classes])
+    largest = counts[class_starts][pair_classes]
+    # the condition holds for l = position + 1 as long as it holds for position, since suffix sums decrease
+    satisfied = largest < c * suffix_sums
+    return int(np.bincount(pair_classes, weights=satisfied).min())
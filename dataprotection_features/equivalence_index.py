@@ -0,0 +1,205 @@
+"""
+This module implements an index of the equivalence classes of a dataset, to monitor k-anonymity and l-diversity
+while records are added to and removed from it.
+"""
+import heapq
+import pandas as pd
+
+
+class EquivalenceClassIndex:
+    """
+    Index of the equivalence classes (the rows with the same quasi-identifier values) of a dataset that changes over
+    time.
+
+    For each class, the index keeps its number of rows and the number of rows with each sensitive value. The classes
+    are also bucketed by size and by number of distinct sensitive values, with a heap of the bucket keys, so adding
+    or removing a batch of rows costs O(number of distinct rows in the batch) and the current k and l are found in
+    O(log n).
+    """
+
+    def __init__(self, qi_columns, sensitive_column=None):
+        """
+        Initialize the EquivalenceClassIndex instance, with no rows.
+
+        Parameters:
+            qi_columns (list): A list of column names representing the quasi-identifier attributes.
+            sensitive_column (str, optional): The name of the column containing sensitive information.
+        """
+        self.qi_columns = list(qi_columns)
+        self.sensitive_column = sensitive_column
+        # class key (tuple of quasi-identifier values) -> [number of rows, {sensitive value: number of rows}]
+        self._classes = {}
+        # size -> keys of the classes of that size, and a heap of the sizes (may contain sizes without classes, it
+        # is rebuilt when they are more than half of it)
+        self._by_size = {}
+        self._size_heap = []
+        # number of distinct sensitive values -> keys of the classes with that many values, and a heap of them
+        self._by_diversity = {}
+        self._diversity_heap = []
+
+    def __len__(self):
+        return len(self._classes)
+
+    def add_rows(self, df):
+        """
+        Add rows to the index.
+
+        Parameters:
+            df (pandas.DataFrame): The rows to add, containing the quasi-identifier and sensitive columns.
+        """
+        self._update(df, 1)
+
+    def remove_rows(self, df):
+        """
+        Remove rows from the index.
+
+        Parameters:
+            df (pandas.DataFrame): The rows to remove, containing the quasi-identifier and sensitive columns. They
+                must have been added before.
+        """
+        self._update(df, -1)
+
+    @property
+    def k(self):
+        """
+        The size of the smallest equivalence class, i.e., the maximum k for which k-anonymity is satisfied (None if
+        the index is empty).
+        """
+        return _minimum(self._by_size, self._size_heap)
+
+    @property
+    def l_diversity(self):
+        """
+        The minimum number of distinct sensitive values in an equivalence class, i.e., the maximum l for which
+        l-diversity is satisfied (None if the index is empty or there is no sensitive column).
+        """
+        if self.sensitive_column is None:
+            return None
+        return _minimum(self._by_diversity, self._diversity_heap)
+
+    def satisfies_k_anonymity(self, k):
+        """
+        Determine if the indexed rows satisfy k-anonymity.
+
+        Parameters:
+            k (int): The desired k value for k-anonymity.
+
+        Returns:
+            bool: True if every equivalence class has at least k rows, False otherwise.
+        """
+        return self.k is None or self.k >= k
+
+    def satisfies_l_diversity(self, l):
+        """
+        Determine if the indexed rows satisfy l-diversity.
+
+        Parameters:
+            l (int): The desired l value for l-diversity.
+
+        Returns:
+            bool: True if every equivalence class has at least l distinct sensitive values, False otherwise.
+        """
+        return self.l_diversity is None or self.l_diversity >= l
+
+    def violating_classes(self, k=None, l=None):
+        """
+        Find the equivalence classes that break k-anonymity or l-diversity.
+
+        Parameters:
+            k (int, optional): The desired k value for k-anonymity.
+            l (int, optional): The desired l value for l-diversity.
+
+        Returns:
+            dict: The number of rows and sensitive-value counts of each class with fewer than k rows or fewer than l
+            distinct sensitive values, by the tuple of its quasi-identifier values.
+        """
+        keys = set()
+        if k is not None:
+            keys.update(key for size, bucket in self._by_size.items() if size < k for key in bucket)
+        if l is not None:
+            keys.update(key for diversity, bucket in self._by_diversity.items() if diversity < l for key in bucket)
+        return {key: (self._classes[key][0], dict(self._classes[key][1])) for key in keys}
+
+    def _update(self, df, sign):
+        columns = self.qi_columns + ([self.sensitive_column] if self.sensitive_column is not None else [])
+        # one entry per distinct (quasi-identifier values, sensitive value) of the batch. only the observed
+        # combinations of categorical columns, the others have no rows
+        counts = df.groupby(columns, sort=False, dropna=False, observed=True).size()
+        updates = {}
+        for values, count in counts.items():
+            # missing values of different types are the same key
+            values = tuple(None if pd.isna(value) else value for value in
+                           (values if isinstance(values, tuple) else (values,)))
+            key, value = (values[:-1], values[-1]) if self.sensitive_column is not None else (values, None)
+            updates.setdefault(key, []).append((value, sign * int(count)))
+        if sign < 0:
+            # checks the whole batch before changing the index
+            for key, changes in updates.items():
+                size, hist = self._classes.get(key, (0, {}))
+                if self.sensitive_column is None:
+                    remaining = [size + change for _, change in changes]
+                else:
+                    remaining = [hist.get(value, 0) + change for value, change in changes]
+                if min(remaining) < 0:
+                    raise ValueError("cannot remove rows that are not in the index: %s" % (key,))
+        for key, changes in updates.items():
+            old_size, hist = self._classes.get(key, (0, {}))
+            old_diversity = len(hist)
+            size = old_size + sum(change for _, change in changes)
+            if self.sensitive_column is not None:
+                for value, change in changes:
+                    hist[value] = hist.get(value, 0) + change
+                    if hist[value] == 0:
+                        del hist[value]
+            if size == 0:
+                del self._classes[key]
+            else:
+                self._classes[key] = [size, hist]
+            _move(self._by_size, self._size_heap, key, old_size, size)
+            if self.sensitive_column is not None:
+                _move(self._by_diversity, self._diversity_heap, key, old_diversity, len(hist))
+
+
+def _move(buckets, heap, key, old, new):
+    """
+    Move a class from one bucket to another.
+
+    Parameters:
+        buckets (dict): The keys of the classes of each bucket.
+        heap (list): Heap of the bucket numbers, which may contain empty buckets. It is rebuilt from the buckets
+            when it is more than twice as large, so that it does not grow with the number of changes.
+        key (tuple): The key of the class.
+        old (int): The bucket of the class before the change, 0 if it was not in the index.
+        new (int): The bucket of the class after the change, 0 if it was removed from the index.
+    """
+    if old == new:
+        return
+    if old:
+        buckets[old].discard(key)
+        if not buckets[old]:
+            del buckets[old]
+    if new:
+        if new not in buckets:
+            buckets[new] = set()
+            if len(heap) >= 2 * len(buckets):
+                heap[:] = list(buckets)
+                heapq.heapify(heap)
+            else:
+                heapq.heappush(heap, new)
+        buckets[new].add(key)
+
+
+def _minimum(buckets, heap):
+    """
+    Find the smallest bucket that is not empty.
+
+    Parameters:
+        buckets (dict): The keys of the classes of each bucket.
+        heap (list): Heap of the bucket numbers, which may contain empty buckets. They are removed.
+
+    Returns:
+        int: The smallest bucket number with classes, None if there are none.
+    """
+    while heap and heap[0] not in buckets:
+        heapq.heappop(heap)
+    return heap[0] if heap else None
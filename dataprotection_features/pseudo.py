@@ -1,6 +1,8 @@
 """
 This modules implements a pseudonymization method.
 """
+import hmac
+import numpy as np
 import pandas as pd
 import random
 import hashlib
@@ -40,3 +42,84 @@ def pseudonymize_column(df, column_name):
 
     return (mapping,pseudonymized_df)
 
+
+def pseudonymize_columns(df, columns, key, digest_size=32, binary=False, output="categorical"):
+    """
+    Pseudonymize several columns of a DataFrame with a keyed hash (HMAC-SHA-256).
+
+    Parameters:
+        df (pandas.DataFrame): The input DataFrame containing the data to be pseudonymized.
+        columns (list): The names of the columns to be pseudonymized.
+        key (bytes or str): The secret key of the HMAC. The same key gives the same pseudonyms.
+        digest_size (int): The number of bytes of the digest kept in each pseudonym, at most 32.
+        binary (bool): Whether pseudonyms are the raw digest bytes, instead of their hexadecimal string.
+        output (str): 'categorical' for pseudonymized columns of pandas categorical type, whose categories are the
+            pseudonyms, or 'integer' for unsigned 64-bit integer pseudonyms (requires digest_size <= 8).
+
+    Returns:
+        tuple: A dictionary mapping each pseudonymized column name to its reversal table (a pandas.Series of the
+        original values, indexed by pseudonym), and a new DataFrame with the specified columns pseudonymized.
+
+    Each column is factorized, so that only its distinct values are hashed, and the pseudonyms are mapped back to
+    the rows with the integer codes of the values. The other columns are not copied. Values are hashed as their text,
+    so a column with distinct values of the same text (e.g., 1 and '1', or a missing value and 'nan') is rejected.
+    """
+    if output not in ("categorical", "integer"):
+        raise ValueError("output should be either 'categorical' or 'integer'")
+    if not 1 <= digest_size <= (8 if output == "integer" else 32):
+        raise ValueError("digest_size should be between 1 and 32, and at most 8 for integer output")
+    if isinstance(key, str):
+        key = key.encode()
+    pseudonymized_df = df.copy(deep=False)
+    tables = {}
+    for column_name in columns:
+        codes, uniques = pd.factorize(df[column_name], use_na_sentinel=False)
+        # values are hashed as text, distinct values with the same text (e.g., 1 and '1') would get the same pseudonym
+        texts = pd.Index([str(value) for value in uniques])
+        if not texts.is_unique:
+            raise ValueError("column %s contains distinct values with the same text, e.g., %r, convert it to a single "
+                             "type first" % (column_name, texts[texts.duplicated()][0]))
+        digests = [hmac.new(key, text.encode(), hashlib.sha256).digest()[:digest_size] for text in texts]
+        if output == "integer":
+            # big-endian, so that the integer is the same as the hexadecimal pseudonym
+            pseudonyms = pd.Index(np.frombuffer(b"".join(digest.rjust(8, b"\0") for digest in digests), dtype=">u8")
+                                  .astype(np.uint64))
+        elif binary:
+            pseudonyms = pd.Index(digests, dtype=object)
+        else:
+            pseudonyms = pd.Index([digest.hex() for digest in digests], dtype=object)
+        if not pseudonyms.is_unique:
+            raise ValueError("pseudonyms of column %s collide, digest_size should be larger" % column_name)
+        if output == "integer":
+            pseudonymized_df[column_name] = pseudonyms.to_numpy().take(codes)
+        else:
+            pseudonymized_df[column_name] = pd.Categorical.from_codes(codes, categories=pseudonyms)
+        tables[column_name] = pd.Series(uniques, index=pseudonyms)
+    return (tables, pseudonymized_df)
+
+
+def depseudonymize_columns(df, tables):
+    """
+    Restore the original values of columns pseudonymized with pseudonymize_columns.
+
+    Parameters:
+        df (pandas.DataFrame): The DataFrame with pseudonymized columns.
+        tables (dict): The reversal table of each pseudonymized column, as returned by pseudonymize_columns.
+
+    Returns:
+        pandas.DataFrame: A new DataFrame with the original values of the pseudonymized columns.
+    """
+    restored_df = df.copy(deep=False)
+    for column_name, table in tables.items():
+        column = df[column_name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # only the categories are looked up
+            positions = table.index.get_indexer(column.cat.categories)
+            codes = column.cat.codes.to_numpy()
+            positions = np.where(codes >= 0, positions[codes], -1)
+        else:
+            positions = table.index.get_indexer(column)
+        if (positions < 0).any():
+            raise ValueError("column %s contains unknown pseudonyms" % column_name)
+        restored_df[column_name] = table.to_numpy().take(positions)
+    return restored_df
@@ -0,0 +1,149 @@
+"""
+This module implements a persistent pseudonym vault, to pseudonymize data consistently across runs and files.
+"""
+import secrets
+import sqlite3
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# maximum number of values in one SQL query, below the default SQLite limit of 999 variables
+BATCH_SIZE = 900
+
+
+class PseudonymVault:
+    """
+    Pseudonym vault stored in a local SQLite database.
+
+    Each distinct value of a domain (e.g., a column) gets a random pseudonym the first time it is pseudonymized, and
+    the same pseudonym afterwards, also in later runs. Pseudonyms are not derived from the values, so they can only be
+    reversed with the vault. Both the value -> pseudonym and the pseudonym -> value lookups are indexed, values are
+    looked up and inserted in batches, and the most recently used pseudonyms are kept in an in-memory LRU cache, so
+    memory does not grow with the number of distinct values.
+    """
+
+    def __init__(self, path, pseudonym_size=16, cache_size=100000):
+        """
+        Open (or create) a pseudonym vault.
+
+        Parameters:
+            path (str): The path of the SQLite database file.
+            pseudonym_size (int): The number of random bytes of new pseudonyms, which are stored as hexadecimal
+                strings.
+            cache_size (int): The maximum number of pseudonyms kept in the LRU cache.
+        """
+        self.path = path
+        self.pseudonym_size = pseudonym_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS pseudonyms (domain TEXT NOT NULL, value TEXT NOT NULL, "
+                                 "pseudonym TEXT NOT NULL, PRIMARY KEY (domain, value)) WITHOUT ROWID")
+        self._connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS pseudonyms_reverse "
+                                 "ON pseudonyms (domain, pseudonym)")
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the vault.
+        """
+        self._connection.close()
+
+    def pseudonymize(self, domain, values):
+        """
+        Get the pseudonyms of values, creating pseudonyms for the values that do not have one yet.
+
+        Parameters:
+            domain (str): The domain of the values, e.g., the column name. The same value gets different pseudonyms
+                in different domains.
+            values (array-like): The values to pseudonymize. They are converted to strings. Missing values stay
+                missing.
+
+        Returns:
+            numpy.ndarray: The pseudonym of each value.
+        """
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        uniques = [str(value) for value in uniques]
+        pseudonyms = self._cached(domain, uniques)
+        missing = [value for value, pseudonym in zip(uniques, pseudonyms) if pseudonym is None]
+        if missing:
+            found = self._select(domain, "value", "pseudonym", missing)
+            new = {value: secrets.token_hex(self.pseudonym_size) for value in missing if value not in found}
+            if new:
+                with self._connection:
+                    self._connection.executemany("INSERT INTO pseudonyms (domain, value, pseudonym) VALUES (?, ?, ?)",
+                                                 [(domain, value, pseudonym) for value, pseudonym in new.items()])
+            found.update(new)
+            pseudonyms = [pseudonym if pseudonym is not None else found[value]
+                          for value, pseudonym in zip(uniques, pseudonyms)]
+            for value in missing:
+                self._remember(domain, value, found[value])
+        # missing values have code -1, which takes the appended None
+        return np.array(pseudonyms + [None], dtype=object).take(codes)
+
+    def reverse(self, domain, pseudonyms):
+        """
+        Get the original values of pseudonyms.
+
+        Parameters:
+            domain (str): The domain of the values, e.g., the column name.
+            pseudonyms (array-like): The pseudonyms. Missing values stay missing.
+
+        Returns:
+            numpy.ndarray: The original value (as a string) of each pseudonym.
+        """
+        codes, uniques = pd.factorize(pd.Series(pseudonyms, dtype=object))
+        found = self._select(domain, "pseudonym", "value", list(uniques))
+        unknown = [pseudonym for pseudonym in uniques if pseudonym not in found]
+        if unknown:
+            raise ValueError("unknown pseudonyms in domain %s: %s" % (domain, unknown[:5]))
+        return np.array([found[pseudonym] for pseudonym in uniques] + [None], dtype=object).take(codes)
+
+    def pseudonymize_csv(self, input_path, output_path, columns, chunk_size=100000):
+        """
+        Pseudonymize columns of a CSV file, reading and writing it in chunks so that it does not need to fit in
+        memory.
+
+        Parameters:
+            input_path (str): The path of the input CSV file.
+            output_path (str): The path of the output CSV file.
+            columns (list): The names of the columns to pseudonymize. Each column is its own domain.
+            chunk_size (int): The number of rows read at a time.
+        """
+        chunks = pd.read_csv(input_path, dtype={column: str for column in columns}, chunksize=chunk_size)
+        for i, chunk in enumerate(chunks):
+            for column in columns:
+                chunk[column] = self.pseudonymize(column, chunk[column])
+            chunk.to_csv(output_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+
+    def _cached(self, domain, values):
+        # returns the cached pseudonym of each value, None if it is not in the cache
+        pseudonyms = []
+        for value in values:
+            pseudonym = self._cache.get((domain, value))
+            if pseudonym is not None:
+                self._cache.move_to_end((domain, value))
+            pseudonyms.append(pseudonym)
+        return pseudonyms
+
+    def _remember(self, domain, value, pseudonym):
+        self._cache[(domain, value)] = pseudonym
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _select(self, domain, key_column, result_column, keys):
+        # looks up keys in batches, returns a dictionary from each key found to its result
+        found = {}
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch = keys[start:start + BATCH_SIZE]
+            query = "SELECT %s, %s FROM pseudonyms WHERE domain = ? AND %s IN (%s)" % (
+                key_column, result_column, key_column, ", ".join("?" * len(batch)))
+            found.update(self._connection.execute(query, [domain] + batch).fetchall())
+        return found
@@ -0,0 +1,80 @@
+"""
+This module contains functions to measure the re-identification risk of the records of a dataset under the
+prosecutor, journalist and marketer attacker models.
+"""
+import numpy as np
+import pandas as pd
+
+def class_sizes(df, qi_columns, population=None):
+    """
+    Find the size of the equivalence class (the rows with the same quasi-identifier values) of each row.
+
+    Parameters:
+        df (pandas.DataFrame): The input DataFrame (the released sample).
+        qi_columns (list): A list of column names representing the quasi-identifier attributes.
+        population (pandas.DataFrame, optional): The population the sample was drawn from. If given, the sizes of the
+            classes in the population are also returned.
+
+    Returns:
+        tuple: The size of the class of each row in the sample, and in the population (the same array if population
+        is None). A class is assumed to be at least as large in the population as in the sample.
+    """
+    if population is None:
+        class_ids = df.groupby(qi_columns, sort=False, dropna=False).ngroup().to_numpy()
+        sample_sizes = np.bincount(class_ids)[class_ids]
+        return sample_sizes, sample_sizes
+    # the classes of the sample and the population are numbered together, so that they match
+    class_ids = pd.concat([df[qi_columns], population[qi_columns]], ignore_index=True) \
+        .groupby(qi_columns, sort=False, dropna=False).ngroup().to_numpy()
+    sample_ids, population_ids = class_ids[:len(df)], class_ids[len(df):]
+    n_classes = class_ids.max() + 1
+    sample_sizes = np.bincount(sample_ids, minlength=n_classes)[sample_ids]
+    population_sizes = np.maximum(np.bincount(population_ids, minlength=n_classes)[sample_ids], sample_sizes)
+    return sample_sizes, population_sizes
+
+def reidentification_risk(df, qi_columns, population=None, top_n=10):
+    """
+    Measure the re-identification risk of each record of a dataset, and of the dataset as a whole.
+
+    The prosecutor risk of a record is 1 / (size of its equivalence class in the dataset): the attacker knows that
+    the target is in the dataset. The journalist risk is 1 / (size of its class in the population): the attacker
+    does not know whether the target is in the dataset. The marketer risk is the expected fraction of records that an
+    attacker trying to re-identify all of them would re-identify, i.e., the average journalist risk. Without a
+    population, the dataset is considered to be the population, so the journalist risk equals the prosecutor risk.
+
+    Parameters:
+        df (pandas.DataFrame): The input DataFrame (the released sample).
+        qi_columns (list): A list of column names representing the quasi-identifier attributes.
+        population (pandas.DataFrame, optional): The population the sample was drawn from.
+        top_n (int): The number of riskiest records to return.
+
+    Returns:
+        dict: The risks:
+            'prosecutor': numpy.ndarray of the prosecutor risk of each row.
+            'journalist': numpy.ndarray of the journalist risk of each row.
+            'marketer': the marketer risk of the dataset.
+            'summary': pandas.DataFrame of the minimum, mean, median and maximum risk of the rows, and the fraction
+                of rows with the maximum risk, for the prosecutor and journalist models.
+            'top': pandas.DataFrame of the top_n rows with the highest prosecutor risk (then journalist risk, then
+                first rows first), with their risks.
+    """
+    sample_sizes, population_sizes = class_sizes(df, qi_columns, population)
+    risks = {"prosecutor": 1.0 / sample_sizes, "journalist": 1.0 / population_sizes}
+    summary = pd.DataFrame({model: {"min": risk.min(), "mean": risk.mean(), "median": np.median(risk),
+                                    "max": risk.max(), "highest_risk_fraction": np.mean(risk == risk.max())}
+                            for model, risk in risks.items()}).T
+    # smallest classes first, ordered by sample size, then population size, then row. only the top_n rows are sorted.
+    keys = sample_sizes.astype(np.int64) * (int(population_sizes.max()) + 1) + population_sizes
+    top_n = max(min(top_n, len(df)), 0)
+    if 0 < top_n < len(df):
+        # the rows below the key of the top_n-th row, and the first rows with that key
+        threshold = np.partition(keys, top_n - 1)[top_n - 1]
+        below = np.flatnonzero(keys < threshold)
+        candidates = np.concatenate((below, np.flatnonzero(keys == threshold)[:top_n - len(below)]))
+    else:
+        candidates = np.arange(top_n)
+    top_rows = candidates[np.lexsort((candidates, keys[candidates]))]
+    top = df.iloc[top_rows].assign(prosecutor_risk=risks["prosecutor"][top_rows],
+                                   journalist_risk=risks["journalist"][top_rows])
+    return {"prosecutor": risks["prosecutor"], "journalist": risks["journalist"],
+            "marketer": float(risks["journalist"].mean()), "summary": summary, "top": top}
@@ -1,12 +1,15 @@
 import pytest
 import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
 from sklearn.compose import ColumnTransformer
 from sklearn.impute import SimpleImputer
 from sklearn.pipeline import Pipeline
 from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
 from sklearn.preprocessing import OneHotEncoder
+from sklearn.exceptions import NotFittedError
 
-from apt.anonymization import Anonymize
+from apt.anonymization import Anonymize, HistogramTree
 from apt.utils.dataset_utils import get_iris_dataset_np, get_adult_dataset_pd, get_nursery_dataset_pd
 from sklearn.datasets import load_diabetes
 from sklearn.model_selection import train_test_split
@@ -30,6 +33,29 @@ def test_anonymize_ndarray_iris():
     assert ((np.delete(anon, QI, axis=1) == np.delete(x_train, QI, axis=1)).all())
 
 
+def test_anonymize_ndarray_iris_mean_representative():
+    (x_train, y_train), _ = get_iris_dataset_np()
+
+    k = 10
+    QI = [0, 2]
+    anonymizer = Anonymize(k, QI, train_only_QI=True, representative='mean')
+    anon = anonymizer.anonymize(ArrayDataset(x_train, y_train))
+    cells, cell_ids, counts_elements = np.unique(anon[:, QI], axis=0, return_inverse=True, return_counts=True)
+    assert (np.min(counts_elements) >= k)
+    for i, cell in enumerate(cells):
+        np.testing.assert_allclose(cell, x_train[cell_ids.ravel() == i][:, QI].mean(axis=0))
+    assert ((np.delete(anon, QI, axis=1) == np.delete(x_train, QI, axis=1)).all())
+
+    # means of integer data are not truncated
+    x_int = np.round(x_train * 10).astype(np.int64)
+    anon = Anonymize(k, QI, train_only_QI=True, representative='mean').anonymize(ArrayDataset(x_int, y_train))
+    assert (anon.dtype == np.float64)
+    cells, cell_ids = np.unique(anon[:, QI], axis=0, return_inverse=True)
+    for i, cell in enumerate(cells):
+        np.testing.assert_allclose(cell, x_int[cell_ids.ravel() == i][:, QI].mean(axis=0))
+    assert ((np.delete(anon, QI, axis=1) == np.delete(x_int, QI, axis=1)).all())
+
+
 def test_anonymize_pandas_adult():
     (x_train, y_train), _ = get_adult_dataset_pd()
 
@@ -98,6 +124,227 @@ def test_anonymize_pandas_nursery():
     np.testing.assert_array_equal(anon.drop(QI, axis=1), x_train.drop(QI, axis=1))
 
 
+def test_fit_transform_pandas_adult():
+    (x_train, y_train), (x_test, y_test) = get_adult_dataset_pd()
+    x_train = x_train.iloc[:5000]
+    y_train = y_train.iloc[:5000]
+
+    k = 50
+    QI = ['age', 'workclass', 'education-num', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+          'native-country']
+    categorical_features = ['workclass', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+                            'native-country']
+    anon = Anonymize(k, QI, categorical_features=categorical_features).anonymize(ArrayDataset(x_train, y_train))
+
+    anonymizer = Anonymize(k, QI, categorical_features=categorical_features)
+    anonymizer.fit(ArrayDataset(x_train, y_train))
+    np.testing.assert_array_equal(anonymizer.transform(ArrayDataset(x_train)), anon)
+
+    anon_test = anonymizer.transform(ArrayDataset(x_test))
+    assert (anon_test.shape == x_test.shape)
+    train_cells = set(anon.loc[:, QI].itertuples(index=False))
+    assert (set(anon_test.loc[:, QI].itertuples(index=False)).issubset(train_cells))
+    np.testing.assert_array_equal(anon_test.drop(QI, axis=1), x_test.drop(QI, axis=1))
+
+
+def test_refit_pandas_adult():
+    (x_train, y_train), _ = get_adult_dataset_pd()
+    x_train = x_train.iloc[:3000]
+    y_train = y_train.iloc[:3000]
+
+    k = 50
+    QI = ['age', 'workclass', 'education-num', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+          'native-country']
+    categorical_features = ['workclass', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+                            'native-country']
+    anonymizer = Anonymize(k, QI, categorical_features=categorical_features)
+    anonymizer.fit(ArrayDataset(x_train.iloc[:1500], y_train.iloc[:1500]))
+    # the instance can be fitted again with the same feature names
+    anonymizer.fit(ArrayDataset(x_train, y_train))
+    assert (anonymizer.quasi_identifiers == QI)
+    assert (anonymizer.categorical_features == categorical_features)
+    anon = Anonymize(k, QI, categorical_features=categorical_features).anonymize(ArrayDataset(x_train, y_train))
+    np.testing.assert_array_equal(anonymizer.transform(ArrayDataset(x_train)), anon)
+    anonymizer.sweep(ArrayDataset(x_train, y_train), [k, 2 * k])
+    np.testing.assert_array_equal(anonymizer.anonymize(ArrayDataset(x_train, y_train)), anon)
+
+
+def test_anonymize_file_csv(tmp_path):
+    (x_train, y_train), _ = get_adult_dataset_pd()
+    x_train = x_train.iloc[:5000].reset_index(drop=True)
+    input_path = str(tmp_path / 'adult.csv')
+    output_path = str(tmp_path / 'adult_anon.csv')
+    x_train.assign(label=y_train.iloc[:5000].values).to_csv(input_path, index=False)
+
+    k = 50
+    QI = ['age', 'workclass', 'education-num', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+          'native-country']
+    categorical_features = ['workclass', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+                            'native-country']
+    anonymizer = Anonymize(k, QI, categorical_features=categorical_features)
+    counts = anonymizer.anonymize_file(input_path, output_path, 'label', chunk_size=700, sample_size=2000,
+                                       random_state=0)
+    anon = pd.read_csv(output_path)
+
+    assert (counts.sum() == x_train.shape[0])
+    assert (anon.shape == (x_train.shape[0], x_train.shape[1] + 1))
+    assert (anon.loc[:, QI].value_counts().min() >= k)
+    np.testing.assert_array_equal(anon.drop(QI + ['label'], axis=1), x_train.drop(QI, axis=1))
+    np.testing.assert_array_equal(anon['label'], y_train.iloc[:5000])
+
+
+def test_anonymize_file_npy(tmp_path):
+    (x_train, y_train), _ = get_iris_dataset_np()
+    input_path = str(tmp_path / 'iris.npy')
+    output_path = str(tmp_path / 'iris_anon.npy')
+    np.save(input_path, np.column_stack([x_train, y_train]))
+
+    k = 10
+    QI = [0, 2]
+    anonymizer = Anonymize(k, QI, train_only_QI=True)
+    anonymizer.anonymize_file(input_path, output_path, 4, chunk_size=16, sample_size=None)
+    anon = np.load(output_path)
+    expected = Anonymize(k, QI, train_only_QI=True).anonymize(ArrayDataset(x_train, y_train))
+
+    np.testing.assert_array_equal(anon[:, :4], expected)
+    np.testing.assert_array_equal(anon[:, 4], y_train)
+
+
+def test_anonymize_pandas_adult_ordinal_encoding():
+    (x_train, y_train), _ = get_adult_dataset_pd()
+
+    k = 100
+    QI = ['age', 'workclass', 'education-num', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+          'native-country']
+    categorical_features = ['workclass', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+                            'native-country']
+    for tree_method in ['exact', 'hist']:
+        anonymizer = Anonymize(k, QI, categorical_features=categorical_features, categorical_encoding='ordinal',
+                               tree_method=tree_method)
+        anon = anonymizer.anonymize(ArrayDataset(x_train, y_train))
+        assert (anonymizer._preprocessor.transform(x_train.to_numpy()).shape == x_train.shape)
+        assert (anon.loc[:, QI].drop_duplicates().shape[0] < x_train.loc[:, QI].drop_duplicates().shape[0])
+        assert (anon.loc[:, QI].value_counts().min() >= k)
+        np.testing.assert_array_equal(anon.drop(QI, axis=1), x_train.drop(QI, axis=1))
+
+
+def test_anonymize_compact():
+    (x_train, y_train), _ = get_adult_dataset_pd()
+    x_train = x_train.iloc[:5000]
+    y_train = y_train.iloc[:5000]
+
+    k = 50
+    QI = ['age', 'workclass', 'education-num', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+          'native-country']
+    categorical_features = ['workclass', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+                            'native-country']
+    anon = Anonymize(k, QI, categorical_features=categorical_features).anonymize(ArrayDataset(x_train, y_train))
+    anonymizer = Anonymize(k, QI, categorical_features=categorical_features)
+    dataset = ArrayDataset(x_train, y_train)
+    compact = anonymizer.anonymize(dataset, compact=True)
+
+    assert (compact.cell_ids.dtype == np.int32)
+    assert (compact.representatives.shape == (len(np.unique(compact.cell_ids)), len(QI)))
+    assert (np.bincount(compact.cell_ids).min() >= k)
+    assert (compact.samples is dataset.get_samples())
+    pd.testing.assert_frame_equal(compact.materialize(), anon)
+    np.testing.assert_array_equal(compact.to_pandas().astype(object), anon)
+    assert (compact.to_pandas()['age'].dtype.name == 'category')
+    pd.testing.assert_frame_equal(anonymizer.transform(dataset, compact=True).materialize(), anon)
+
+
+def test_sweep():
+    (x_train, y_train), _ = get_adult_dataset_pd()
+
+    QI = ['age', 'workclass', 'education-num', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+          'native-country']
+    categorical_features = ['workclass', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+                            'native-country']
+    k_values = [10, 25, 100, 1000]
+    anonymizer = Anonymize(10, QI, categorical_features=categorical_features)
+    anonymized = anonymizer.sweep(ArrayDataset(x_train, y_train), k_values, compact=True)
+
+    assert (sorted(anonymized.keys()) == k_values)
+    anon = Anonymize(10, QI, categorical_features=categorical_features).anonymize(ArrayDataset(x_train, y_train))
+    pd.testing.assert_frame_equal(anonymized[10].materialize(), anon)
+    n_cells = len(x_train)
+    for k in k_values:
+        counts = np.bincount(anonymized[k].cell_ids)
+        assert (counts.min() >= k)
+        assert (len(counts) <= n_cells)
+        n_cells = len(counts)
+        anon = anonymized[k].materialize()
+        assert (anon.loc[:, QI].value_counts().min() >= k)
+        np.testing.assert_array_equal(anon.drop(QI, axis=1), x_train.drop(QI, axis=1))
+
+    (x_train, y_train), _ = get_iris_dataset_np()
+    anonymized = Anonymize(5, [0, 2]).sweep(ArrayDataset(x_train, y_train), [5, 30])
+    _, counts_elements = np.unique(anonymized[30][:, [0, 2]], axis=0, return_counts=True)
+    assert (np.min(counts_elements) >= 30)
+    with pytest.raises(ValueError):
+        Anonymize(5, [0, 2]).sweep(ArrayDataset(x_train, y_train), [2, 30])
+
+
+def test_anonymize_deduplicate():
+    (x_train, y_train), _ = get_adult_dataset_pd()
+    x_train = pd.concat([x_train.iloc[:3000]] * 3, ignore_index=True)
+    y_train = pd.concat([y_train.iloc[:3000]] * 3, ignore_index=True)
+
+    k = 30
+    QI = ['age', 'workclass', 'education-num', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+          'native-country']
+    categorical_features = ['workclass', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+                            'native-country']
+    for tree_method in ['exact', 'hist']:
+        anonymizer = Anonymize(k, QI, categorical_features=categorical_features, train_only_QI=True,
+                               tree_method=tree_method, deduplicate=True)
+        anon = anonymizer.anonymize(ArrayDataset(x_train, y_train))
+        assert (anon.loc[:, QI].drop_duplicates().shape[0] < x_train.loc[:, QI].drop_duplicates().shape[0])
+        assert (anon.loc[:, QI].value_counts().min() >= k)
+        np.testing.assert_array_equal(anon.drop(QI, axis=1), x_train.drop(QI, axis=1))
+        # duplicate rows end up in the same cell
+        np.testing.assert_array_equal(anon.iloc[:3000], anon.iloc[3000:6000])
+
+    (x_train, y_train), _ = get_iris_dataset_np()
+    anonymizer = Anonymize(100, [0, 2], deduplicate=True)
+    anon = anonymizer.anonymize(ArrayDataset(x_train, y_train))
+    assert (len(np.unique(anon[:, [0, 2]], axis=0)) == 1)
+
+
+def test_stats():
+    (x_train, y_train), _ = get_adult_dataset_pd()
+
+    k = 50
+    QI = ['age', 'workclass', 'education-num', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+          'native-country']
+    categorical_features = ['workclass', 'marital-status', 'occupation', 'relationship', 'race', 'sex',
+                            'native-country']
+    phases = []
+    anonymizer = Anonymize(k, QI, categorical_features=categorical_features, trace_memory=True,
+                           stats_callback=lambda name, stats: phases.append(name))
+    anon = anonymizer.anonymize(ArrayDataset(x_train, y_train))
+    stats = anonymizer.stats
+
+    assert (set(stats.keys()) == {'encoding', 'tree_fitting', 'apply', 'calculate_cells', 'find_representatives',
+                                  'anonymize_data'})
+    assert (set(phases) == set(stats.keys()))
+    n_cells = anon.loc[:, QI].drop_duplicates().shape[0]
+    assert (stats['tree_fitting'].leaves == stats['calculate_cells'].leaves == stats['find_representatives'].leaves)
+    assert (stats['find_representatives'].leaves >= n_cells)
+    assert (stats['calculate_cells'].rows == 0)
+    for name, phase in stats.items():
+        assert (name == 'calculate_cells' or phase.rows == len(x_train))
+        assert (phase.wall_time > 0)
+        assert (phase.peak_memory > 0)
+
+    (x_train, y_train), _ = get_iris_dataset_np()
+    anonymizer = Anonymize(10, [0, 2])
+    anonymizer.sweep(ArrayDataset(x_train, y_train), [10, 20])
+    assert (anonymizer.stats['merge_leaves'].rows == 2 * len(x_train))
+    assert (anonymizer.stats['merge_leaves'].leaves <= anonymizer.stats['tree_fitting'].leaves)
+    assert (anonymizer.stats['encoding'].peak_memory is None)
+
+
 def test_regression():
     dataset = load_diabetes()
     x_train, x_test, y_train, y_test = train_test_split(dataset.data, dataset.target, test_size=0.5, random_state=14)
@@ -118,6 +365,53 @@ def test_regression():
     assert ((np.delete(anon, QI, axis=1) == np.delete(x_train, QI, axis=1)).all())
 
 
+def test_anonymize_hist_tree():
+    (x_train, y_train), _ = get_iris_dataset_np()
+
+    k = 10
+    QI = [0, 1, 2]
+    anonymizer = Anonymize(k, QI, tree_method='hist')
+    anon = anonymizer.anonymize(ArrayDataset(x_train, y_train))
+    assert (len(np.unique(anon[:, QI], axis=0)) < len(np.unique(x_train[:, QI], axis=0)))
+    _, counts_elements = np.unique(anonymizer._anonymizer.apply(x_train), return_counts=True)
+    assert (np.min(counts_elements) >= k)
+    assert ((np.delete(anon, QI, axis=1) == np.delete(x_train, QI, axis=1)).all())
+
+    dataset = load_diabetes()
+    tree = HistogramTree(min_samples_leaf=k, max_bins=16, is_regression=True).fit(dataset.data, dataset.target)
+    leaves = tree.tree_.feature == -2
+    _, counts_elements = np.unique(tree.apply(dataset.data), return_counts=True)
+    np.testing.assert_array_equal(counts_elements, tree.tree_.n_node_samples[leaves])
+    assert (np.min(counts_elements) >= k)
+    np.testing.assert_allclose(tree.predict(dataset.data), tree.tree_.value[tree.apply(dataset.data), 0, 0])
+
+    # sparse input is binned and routed like the same dense input
+    sparse_data = csr_matrix(np.where(np.abs(dataset.data) < 0.02, 0, dataset.data))
+    dense_tree = HistogramTree(min_samples_leaf=k, max_bins=16).fit(sparse_data.toarray(), dataset.target > 140)
+    sparse_tree = HistogramTree(min_samples_leaf=k, max_bins=16).fit(sparse_data, dataset.target > 140)
+    np.testing.assert_array_equal(sparse_tree.tree_.feature, dense_tree.tree_.feature)
+    np.testing.assert_array_equal(sparse_tree.tree_.threshold, dense_tree.tree_.threshold)
+    np.testing.assert_array_equal(sparse_tree.apply(sparse_data), dense_tree.apply(sparse_data.toarray()))
+
+
+def test_anonymize_hist_tree_cardinality():
+    # with tree_method 'hist', categorical features are encoded ordinally, so the cost of fitting the tree does not
+    # grow with the number of categories
+    rng = np.random.default_rng(0)
+    n = 20000
+    peak_memory = []
+    for n_categories in [10, 3000]:
+        x = pd.DataFrame({'age': rng.integers(18, 90, n), 'zip': rng.integers(0, n_categories, n).astype(str)})
+        y = pd.Series(rng.integers(0, 2, n))
+        anonymizer = Anonymize(50, ['age', 'zip'], categorical_features=['zip'], tree_method='hist',
+                               trace_memory=True)
+        anon = anonymizer.anonymize(ArrayDataset(x, y))
+        assert anon.groupby(['age', 'zip']).size().min() >= 50
+        assert anonymizer._preprocessor.transform(x).shape == (n, 2)
+        peak_memory.append(anonymizer.stats['tree_fitting'].peak_memory)
+    assert peak_memory[1] < 2 * peak_memory[0]
+
+
 def test_errors():
     with pytest.raises(ValueError):
         Anonymize(1, [0, 2])
@@ -125,8 +419,18 @@ def test_errors():
         Anonymize(2, [])
     with pytest.raises(ValueError):
         Anonymize(2, None)
+    with pytest.raises(ValueError):
+        Anonymize(2, [0, 2], representative='mode')
+    with pytest.raises(ValueError):
+        Anonymize(2, [0, 2], tree_method='approx')
+    with pytest.raises(ValueError):
+        Anonymize(2, [0, 2], categorical_encoding='binary')
+    with pytest.raises(ValueError):
+        Anonymize(2, [0, 2], tree_method='hist', categorical_encoding='onehot')
     anonymizer = Anonymize(10, [0, 2])
     (x_train, y_train), (x_test, y_test) = get_iris_dataset_np()
+    with pytest.raises(NotFittedError):
+        anonymizer.transform(dataset=ArrayDataset(x_test))
     with pytest.raises(ValueError):
         anonymizer.anonymize(dataset=ArrayDataset(x_train, y_test))
     (x_train, y_train), _ = get_adult_dataset_pd()
@@ -0,0 +1,56 @@
+import pytest
+import pandas as pd
+
+from dataprotection_features.equivalence_index import EquivalenceClassIndex
+
+
+def test_equivalence_index():
+    df = pd.DataFrame({'age': [20, 20, 30, 30, 30], 'zip': ['a', 'a', 'b', 'b', 'b'],
+                       'disease': ['flu', 'cold', 'flu', 'flu', 'cold']})
+    index = EquivalenceClassIndex(['age', 'zip'], 'disease')
+    index.add_rows(df)
+    assert len(index) == 2
+    assert index.k == 2
+    assert index.l_diversity == 2
+    assert index.satisfies_k_anonymity(2)
+    assert not index.satisfies_k_anonymity(3)
+
+    index.remove_rows(df.iloc[[1]])
+    assert index.k == 1
+    assert index.l_diversity == 1
+    assert index.violating_classes(k=2) == {(20, 'a'): (1, {'flu': 1})}
+
+    with pytest.raises(ValueError):
+        index.remove_rows(pd.DataFrame({'age': [40], 'zip': ['c'], 'disease': ['flu']}))
+    assert index.k == 1
+
+    index.remove_rows(df.iloc[[0]])
+    assert len(index) == 1
+    assert index.k == 3
+
+
+def test_equivalence_index_categorical():
+    # combinations of categories that are not in the rows must not be added or removed
+    df = pd.DataFrame({'zip': pd.Categorical(['x', 'x', 'y', 'y'], categories=['x', 'y', 'z']),
+                       'age': pd.Categorical([1, 1, 2, 2], categories=[1, 2, 3]),
+                       'disease': ['flu', 'cold', 'flu', 'cold']})
+    index = EquivalenceClassIndex(['zip', 'age'], 'disease')
+    index.add_rows(df)
+    assert len(index) == 2
+    assert index.k == 2
+    assert index.l_diversity == 2
+    index.remove_rows(df.iloc[:2])
+    assert len(index) == 1
+    assert index.k == 2
+
+
+def test_equivalence_index_heap_size():
+    df = pd.DataFrame({'age': [20, 20, 30, 30]})
+    index = EquivalenceClassIndex(['age'])
+    index.add_rows(df)
+    for _ in range(1000):
+        index.add_rows(df.iloc[[0]])
+        index.remove_rows(df.iloc[[0]])
+    assert index.k == 2
+    assert index.l_diversity is None
+    assert len(index._size_heap) <= 2 * len(index._by_size)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from dataprotection_features.anonymize_module import Mondrian, MondrianTree, aggregate, anonymize_k_anonymity
+
+
+def test_mondrian_partition_labels():
+    # the partitions returned by partition can be passed back to the other methods, whatever the index labels
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'age': rng.integers(0, 100, 100),
+                       'zip': pd.Categorical(rng.choice(['x', 'y', 'z'], 100)),
+                       'disease': rng.choice(['flu', 'cold'], 100)}, index=range(1000, 1100))
+    mondrian = Mondrian(df, ['age', 'zip'], 'disease')
+    partitions = mondrian.partition(k=5, l=2)
+    assert sorted(np.concatenate(partitions)) == list(df.index)
+    for partition in partitions:
+        assert mondrian.is_valid(partition, k=5, l=2)
+        assert df.loc[partition, 'disease'].nunique() >= 2
+        left, right = mondrian.split('age', partition)
+        assert sorted(left.append(right)) == sorted(partition)
+        assert df.loc[left, 'age'].max() < df.loc[right, 'age'].min()
+
+    spans = mondrian.get_spans(partitions[0])
+    assert spans == {'age': float(np.ptp(df.loc[partitions[0], 'age'])),
+                     'zip': float(df.loc[partitions[0], 'zip'].nunique())}
+    assert mondrian.get_spans(df.index, mondrian.get_spans(df.index)) == {'age': 1.0, 'zip': 1.0}
+
+
+def test_aggregate_missing_categories():
+    df = pd.DataFrame({'zip': pd.Categorical([None, 'a', 'b', 'b', None, None]),
+                       'disease': ['flu', 'cold', 'flu', 'cold', 'flu', 'cold']})
+    # missing values are not counted as a category, partitions with only missing values stay missing
+    anonymized = aggregate(df, np.array([0, 0, 1, 1, 1, 2]), ['zip'], 'disease', verbose=False)
+    assert anonymized['zip'].tolist()[:5] == ['a', 'a', 'b', 'b', 'b']
+    assert pd.isna(anonymized['zip'].iloc[5])
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'age': rng.integers(0, 100, 200),
+                       'zip': pd.Categorical(rng.choice(['x', 'y', None], 200)),
+                       'disease': rng.choice(['flu', 'cold'], 200)})
+    anonymized = anonymize_k_anonymity(df, ['age', 'zip'], 'disease', 5, verbose=False)
+    assert anonymized.groupby(['age', 'zip'], observed=True, dropna=False).size().min() >= 5
+
+
+def _mondrian_data(n):
+    rng = np.random.default_rng(1)
+    return pd.DataFrame({'age': rng.integers(0, 100, n), 'income': rng.normal(50, 20, n).round(1),
+                         'zip': pd.Categorical(rng.choice(['a', 'b', 'c', 'd', 'e'], n)),
+                         'disease': rng.choice(['flu', 'cold', 'cancer'], n)})
+
+
+def test_mondrian_parallel():
+    # parallel partitioning gives exactly the same partitions as serial partitioning
+    df = _mondrian_data(3000)
+    mondrian = Mondrian(df, ['age', 'income', 'zip'], 'disease')
+    for k, l, t in [(5, 0, 0.0), (10, 2, 0.0), (10, 0, 0.3)]:
+        serial = mondrian.partition_ids(k, l, t)
+        np.testing.assert_array_equal(mondrian.partition_ids(k, l, t, n_jobs=2), serial)
+        assert np.bincount(serial).min() >= k
+
+
+def test_mondrian_approximate_median():
+    df = _mondrian_data(3000)
+    for k, l, diversity in [(5, 0, 'distinct'), (10, 3, 'distinct'), (10, 2, 'entropy')]:
+        mondrian = Mondrian(df, ['age', 'income', 'zip'], 'disease', median_sample_size=100, random_state=0)
+        ids = mondrian.partition_ids(k, l, diversity=diversity)
+        # partitions split around sampled medians still satisfy k-anonymity and l-diversity
+        assert np.bincount(ids).min() >= k
+        groups = df.groupby(ids)['disease']
+        if diversity == 'entropy':
+            frequencies = groups.value_counts(normalize=True)
+            entropy = -(frequencies * np.log(frequencies)).groupby(level=0).sum()
+            assert (entropy >= np.log(l) - 1e-9).all()
+        else:
+            assert groups.nunique().min() >= l
+        # the same seed gives the same partitions, also in parallel
+        np.testing.assert_array_equal(mondrian.partition_ids(k, l, diversity=diversity, n_jobs=2), ids)
+
+
+def test_mondrian_tree(tmp_path):
+    df = _mondrian_data(2000)
+    new = _mondrian_data(300).assign(zip=pd.Categorical(np.random.default_rng(2).choice(['a', 'e', 'f'], 300)))
+    mondrian = Mondrian(df, ['age', 'income', 'zip'], 'disease')
+    ids = mondrian.partition_ids(10, 2)
+    for method in ['mean', 'median', 'range']:
+        tree = mondrian.partition_tree(10, 2, method=method)
+        # the tree anonymizes the partitioned dataset exactly as aggregate
+        np.testing.assert_array_equal(tree.apply(df), ids)
+        expected = aggregate(df, ids, ['age', 'income', 'zip'], 'disease', method=method, verbose=False)
+        pd.testing.assert_frame_equal(tree.transform(df), expected)
+
+        path = str(tmp_path / ('tree_%s.npz' % method))
+        tree.save(path)
+        loaded = MondrianTree.load(path)
+        pd.testing.assert_frame_equal(loaded.transform(df), expected)
+        # new records, including a category that was not seen, are anonymized the same way after loading
+        np.testing.assert_array_equal(loaded.apply(new), tree.apply(new))
+        pd.testing.assert_frame_equal(loaded.transform(new), tree.transform(new))
+        anonymized = tree.transform(new)
+        assert set(anonymized['age']) <= set(expected['age'])
@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from dataprotection_features.pseudo import pseudonymize_columns, depseudonymize_columns
+
+
+def test_pseudonymize_columns():
+    df = pd.DataFrame({'name': ['ann', 'bob', 'ann', None], 'age': [30, 40, 30, 50], 'city': ['x', 'y', 'z', 'x']})
+    for kwargs in [{}, {'binary': True}, {'digest_size': 4}, {'output': 'integer', 'digest_size': 8}]:
+        tables, pseudonymized = pseudonymize_columns(df, ['name', 'age'], 'secret', **kwargs)
+        assert set(tables.keys()) == {'name', 'age'}
+        for column in ['name', 'age']:
+            values = pseudonymized[column]
+            # same values get the same pseudonym, different values different ones
+            assert values.nunique(dropna=False) == df[column].nunique(dropna=False)
+            assert values.iloc[0] == values.iloc[2]
+            assert not df[column].isin(values).any()
+        pd.testing.assert_series_equal(pseudonymized['city'], df['city'])
+        restored = depseudonymize_columns(pseudonymized, tables)
+        pd.testing.assert_frame_equal(restored.astype(object), df.astype(object))
+
+    # the same key gives the same pseudonyms, another key other ones
+    _, first = pseudonymize_columns(df, ['name'], b'secret')
+    _, second = pseudonymize_columns(df, ['name'], 'secret')
+    _, other = pseudonymize_columns(df, ['name'], 'other')
+    assert first['name'].tolist() == second['name'].tolist()
+    assert not set(first['name']) & set(other['name'])
+    _, integers = pseudonymize_columns(df, ['name'], 'secret', output='integer', digest_size=8)
+    assert integers['name'].dtype == np.uint64
+    assert [int(pseudonym[:16], 16) for pseudonym in first['name']] == integers['name'].tolist()
+
+
+def test_pseudonymize_columns_errors():
+    df = pd.DataFrame({'a': [1, '1', 2], 'b': [np.nan, 'nan', 'x']})
+    with pytest.raises(ValueError, match='same text'):
+        pseudonymize_columns(df, ['a'], 'secret')
+    with pytest.raises(ValueError, match='same text'):
+        pseudonymize_columns(df, ['b'], 'secret')
+    with pytest.raises(ValueError):
+        pseudonymize_columns(df, ['a'], 'secret', output='integer', digest_size=16)
+    tables, pseudonymized = pseudonymize_columns(pd.DataFrame({'a': ['x', 'y']}), ['a'], 'secret')
+    with pytest.raises(ValueError):
+        depseudonymize_columns(pd.DataFrame({'a': ['unknown']}), tables)
@@ -0,0 +1,52 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from dataprotection_features.pseudo_vault import PseudonymVault
+
+
+def test_pseudonym_vault(tmp_path):
+    path = str(tmp_path / 'vault.db')
+    values = ['ann', 'bob', None, 'ann', np.nan]
+    with PseudonymVault(path, pseudonym_size=8, cache_size=1) as vault:
+        pseudonyms = vault.pseudonymize('name', values)
+        assert pseudonyms[0] == pseudonyms[3]
+        assert pseudonyms[0] != pseudonyms[1]
+        assert len(pseudonyms[0]) == 16
+        # missing values stay missing
+        assert pseudonyms[2] is None and pseudonyms[4] is None
+        # the same value gets another pseudonym in another domain
+        assert vault.pseudonymize('other', ['ann'])[0] != pseudonyms[0]
+        assert vault.reverse('name', pseudonyms).tolist() == ['ann', 'bob', None, 'ann', None]
+        with pytest.raises(ValueError):
+            vault.reverse('name', ['unknown'])
+
+    # values get the same pseudonyms after reopening the vault, new values new ones
+    with PseudonymVault(path) as vault:
+        again = vault.pseudonymize('name', ['bob', 'carl', 'ann'])
+        assert again[0] == pseudonyms[1] and again[2] == pseudonyms[0]
+        assert again[1] not in pseudonyms
+        # more values than fit in a single query
+        many = vault.pseudonymize('id', np.arange(2000))
+        assert len(set(many)) == 2000
+        assert vault.reverse('id', many[::-1]).tolist() == [str(i) for i in range(2000)][::-1]
+
+
+def test_pseudonymize_csv(tmp_path):
+    input_path = str(tmp_path / 'input.csv')
+    output_path = str(tmp_path / 'output.csv')
+    df = pd.DataFrame({'name': ['ann', 'bob', 'ann', None, 'carl'], 'zip': ['01', '02', '01', '03', None],
+                       'age': [30, 40, 30, 50, 60]})
+    df.to_csv(input_path, index=False)
+    with PseudonymVault(str(tmp_path / 'vault.db')) as vault:
+        vault.pseudonymize_csv(input_path, output_path, ['name', 'zip'], chunk_size=2)
+        output = pd.read_csv(output_path, dtype={'name': str, 'zip': str})
+        assert output.shape == df.shape
+        assert output['name'][0] == output['name'][2]
+        assert output['name'].isna().tolist() == df['name'].isna().tolist()
+        np.testing.assert_array_equal(output['age'], df['age'])
+        assert vault.reverse('name', output['name']).tolist() == [value if isinstance(value, str) else None
+                                                                  for value in df['name']]
+        # leading zeros are kept, values are read as strings
+        assert vault.reverse('zip', output['zip'].iloc[:4]).tolist() == ['01', '02', '01', '03']
+        assert output['name'][1] == vault.pseudonymize('name', ['bob'])[0]
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from dataprotection_features.risk import class_sizes, reidentification_risk
+
+
+def test_reidentification_risk():
+    df = pd.DataFrame({'zip': ['a', 'a', 'b', 'b', 'b', 'c'], 'age': [1, 1, 2, 2, 2, 3], 'disease': list('xyxyxy')})
+    qi = ['zip', 'age']
+    sample_sizes, population_sizes = class_sizes(df, qi)
+    np.testing.assert_array_equal(sample_sizes, [2, 2, 3, 3, 3, 1])
+    np.testing.assert_array_equal(population_sizes, sample_sizes)
+
+    risk = reidentification_risk(df, qi, top_n=2)
+    np.testing.assert_allclose(risk['prosecutor'], [1 / 2, 1 / 2, 1 / 3, 1 / 3, 1 / 3, 1])
+    np.testing.assert_allclose(risk['journalist'], risk['prosecutor'])
+    assert np.isclose(risk['marketer'], 3 / 6)
+    summary = risk['summary'].loc['prosecutor']
+    assert np.isclose(summary['min'], 1 / 3)
+    assert np.isclose(summary['median'], (1 / 3 + 1 / 2) / 2)
+    assert np.isclose(summary['max'], 1)
+    assert np.isclose(summary['highest_risk_fraction'], 1 / 6)
+    assert risk['top'].index.tolist() == [5, 0]
+    np.testing.assert_allclose(risk['top']['prosecutor_risk'], [1, 1 / 2])
+
+
+def test_reidentification_risk_population():
+    df = pd.DataFrame({'zip': ['a', 'a', 'b', 'b', 'b', 'c'], 'age': [1, 1, 2, 2, 2, 3]})
+    # class ('c', 3) is missing from the population, so it is assumed to be as large as in the sample
+    population = pd.DataFrame({'zip': ['a'] * 4 + ['b'] * 3 + ['d'] * 5, 'age': [1] * 4 + [2] * 3 + [4] * 5})
+    qi = ['zip', 'age']
+    sample_sizes, population_sizes = class_sizes(df, qi, population)
+    np.testing.assert_array_equal(sample_sizes, [2, 2, 3, 3, 3, 1])
+    np.testing.assert_array_equal(population_sizes, [4, 4, 3, 3, 3, 1])
+
+    risk = reidentification_risk(df, qi, population, top_n=3)
+    np.testing.assert_allclose(risk['journalist'], [1 / 4, 1 / 4, 1 / 3, 1 / 3, 1 / 3, 1])
+    assert np.isclose(risk['marketer'], (1 / 2 + 1 + 1) / 6)
+    assert risk['top'].index.tolist() == [5, 0, 1]
+    np.testing.assert_allclose(risk['top']['journalist_risk'], [1, 1 / 4, 1 / 4])
+    assert len(reidentification_risk(df, qi, top_n=10)['top']) == len(df)